@@ -1,13 +1,21 @@
 import os
 import uuid
-import subprocess
-import json
 import shutil
+import threading
 
-from flask import Flask, render_template, request, send_from_directory, jsonify
+from flask import Flask, Response, redirect, render_template, request, send_from_directory, jsonify
+from werkzeug.http import parse_content_range_header
 from werkzeug.utils import secure_filename
 
-from utils.video import remove_watermark_roi_to_frames
+from utils.ffmpeg import MEDIA_RECORD_VERSION, QUALITY_PRESETS, build_scale_filter, probe_media
+from utils.jobs import Job, JobQueue, QueueFull
+from utils.metrics import JobMetrics
+from utils.pipeline import DECODERS, STAGES
+from utils.preview import FrameCache, data_url, preview_clip, preview_frame
+from utils.process import PIPELINES, process_video
+from utils.storage import (ChunkedUpload, DiskLru, UploadConflict, content_hash, discard_metadata, expire_uploads, follow_file,
+                           is_stored_name, load_metadata, read_range, result_key, save_hashed, save_metadata)
+from utils.video import INPAINT_METHODS, clamp_roi
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(APP_ROOT, 'uploads')
@@ -21,6 +29,33 @@ os.makedirs(TEMP_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB
+app.config['PROCESS_WORKERS'] = int(os.environ.get('PROCESS_WORKERS', 0)) or os.cpu_count() or 1
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+# Write fragmented MP4 that /jobs/<id>/output can serve while encoding; 0 for faststart MP4
+app.config['PROGRESSIVE_OUTPUT'] = os.environ.get('PROGRESSIVE_OUTPUT', '1') != '0'
+# Pipeline for requests that do not name one. Only 'stream' writes its output as it
+# goes, so it is the default while progressive output is on; 'parallel' finishes sooner.
+app.config['DEFAULT_PIPELINE'] = os.environ.get('DEFAULT_PIPELINE') or ('stream' if app.config['PROGRESSIVE_OUTPUT'] else 'parallel')
+# Uploads and outputs together; least recently used files are deleted past this
+app.config['STORAGE_LIMIT'] = int(float(os.environ.get('STORAGE_LIMIT_GB', 20)) * 1024 * 1024 * 1024)
+# Chunk size suggested to resumable upload clients, and how long an unfinished upload is kept
+app.config['UPLOAD_CHUNK_SIZE'] = int(float(os.environ.get('UPLOAD_CHUNK_MB', 8)) * 1024 * 1024)
+app.config['UPLOAD_EXPIRY'] = float(os.environ.get('UPLOAD_EXPIRY_HOURS', 24)) * 3600
+
+job_metrics = JobMetrics()
+job_queue = JobQueue(workers=app.config['JOB_WORKERS'], max_queued=app.config['JOB_QUEUE_SIZE'],
+                     on_finish=lambda job: job_metrics.record(job.to_dict()))
+storage = DiskLru([UPLOAD_FOLDER, OUTPUT_FOLDER], app.config['STORAGE_LIMIT'])
+preview_frames = FrameCache()
+
+# Result cache key -> (job, input_path) for jobs that have not finished yet
+pending_results = {}
+pending_lock = threading.Lock()
+
+# Upload id -> ChunkedUpload for resumable uploads this process has seen
+chunked_uploads = {}
+uploads_lock = threading.Lock()
 
 
 def is_allowed(filename: str) -> bool:
@@ -28,6 +63,81 @@ def is_allowed(filename: str) -> bool:
     return ext in ALLOWED_EXTENSIONS
 
 
+def submit_once(key: str, job: Job, input_path: str) -> Job:
+    """Queue job unless an unfinished job already produces key; returns the job that does.
+
+    Lookup, submit and registration happen under one lock, so identical requests
+    arriving together (e.g. retries) share a single job. Raises QueueFull.
+    """
+    with pending_lock:
+        for pending_key, (pending, _) in list(pending_results.items()):
+            if pending.finished_at is not None:
+                del pending_results[pending_key]
+        entry = pending_results.get(key)
+        if entry is not None:
+            return entry[0]
+        job_queue.submit(job)
+        pending_results[key] = (job, input_path)
+        return job
+
+
+def evict_storage(*keep: str) -> None:
+    # Never evict the inputs of queued or running jobs
+    with pending_lock:
+        in_use = [input_path for job, input_path in pending_results.values() if job.finished_at is None]
+    for path in storage.evict(keep=[*keep, *in_use]):
+        preview_frames.discard(path)
+        discard_metadata(path)
+
+
+def media_info(input_path: str) -> dict:
+    """The probe_media record of an upload; probed and saved again when missing or from an older probe_media."""
+    media = load_metadata(input_path)
+    if media is None or media.get('version') != MEDIA_RECORD_VERSION:
+        media = probe_media(input_path)
+        save_metadata(input_path, media)
+    return media
+
+
+def stored_upload(stored_name: str, duplicate: bool):
+    """Response for a completed upload: probes it once and keeps the record for every later stage."""
+    save_path = os.path.join(UPLOAD_FOLDER, stored_name)
+    try:
+        media = media_info(save_path)
+    except (RuntimeError, ValueError, KeyError) as exc:
+        if not duplicate:
+            os.remove(save_path)
+        return jsonify({'error': f'Not a readable video: {exc}'}), 422
+    storage.touch(save_path)
+    evict_storage(save_path)
+
+    return jsonify({
+        'filename': stored_name,
+        'videoUrl': f"/video/{stored_name}",
+        'duplicate': duplicate,
+        'metadata': {
+            'width': media['width'],
+            'height': media['height'],
+            'fps': media['fps'],
+            'duration': media['duration'],
+            'frameCount': media['frame_count'],
+            'keyframes': len(media['gops']) if media['gops'] else None,
+            'hasAudio': media['has_audio']
+        }
+    })
+
+
+def get_upload(upload_id: str):
+    with uploads_lock:
+        upload = chunked_uploads.get(upload_id)
+        if upload is None:
+            # Unknown here, e.g. after a restart: pick it up from disk
+            upload = ChunkedUpload.open(UPLOAD_FOLDER, upload_id)
+            if upload is not None:
+                chunked_uploads[upload_id] = upload
+        return upload
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -43,143 +153,349 @@ def upload():
     if not is_allowed(file.filename):
         return jsonify({'error': 'Unsupported file type'}), 400
 
-    filename = secure_filename(file.filename)
-    unique_id = uuid.uuid4().hex
-    base, ext = os.path.splitext(filename)
-    stored_name = f"{base}_{unique_id}{ext}"
-    save_path = os.path.join(UPLOAD_FOLDER, stored_name)
-    file.save(save_path)
+    # Stored by content hash, so uploading the same file again reuses the first copy
+    _, ext = os.path.splitext(secure_filename(file.filename).lower())
+    stored_name, duplicate = save_hashed(file.stream, UPLOAD_FOLDER, ext)
+    return stored_upload(stored_name, duplicate)
+
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    # Resumable upload: create it here, then PUT the bytes in order with Content-Range headers
+    data = request.get_json(force=True)
+    filename = data.get('filename') or ''
+    if not is_allowed(filename):
+        return jsonify({'error': 'Unsupported file type'}), 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size must be the file size in bytes'}), 400
+    if not 0 < size <= app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'File is empty or too large'}), 413
+
+    expire_uploads(UPLOAD_FOLDER, app.config['UPLOAD_EXPIRY'])
+    _, ext = os.path.splitext(secure_filename(filename).lower())
+    upload = ChunkedUpload.create(UPLOAD_FOLDER, size, ext)
+    with uploads_lock:
+        for upload_id, other in list(chunked_uploads.items()):
+            if not os.path.exists(other.path):
+                del chunked_uploads[upload_id]
+        chunked_uploads[upload.upload_id] = upload
 
     return jsonify({
-        'filename': stored_name,
-        'videoUrl': f"/video/{stored_name}"
-    })
+        'uploadId': upload.upload_id,
+        'uploadUrl': f"/uploads/{upload.upload_id}",
+        'offset': 0,
+        'size': size,
+        'chunkSize': app.config['UPLOAD_CHUNK_SIZE']
+    }), 201
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    # Where to resume after a failed PUT
+    upload = get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'uploadId': upload_id, 'offset': upload.offset, 'size': upload.size})
+
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    upload = get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes' or content_range.length != upload.size:
+        return jsonify({'error': f'Content-Range must be bytes <start>-<end>/{upload.size}'}), 400
+
+    with upload.lock:
+        try:
+            # Streamed from the socket straight onto the end of the upload file
+            offset = upload.write(request.stream, content_range.start)
+        except UploadConflict as exc:
+            return jsonify({'error': str(exc), 'offset': exc.offset}), 409
+        except RuntimeError as exc:
+            return jsonify({'error': str(exc), 'offset': upload.offset}), 400
+        if offset < upload.size:
+            return jsonify({'uploadId': upload_id, 'offset': offset, 'size': upload.size})
+        stored_name, duplicate = upload.finish()
+    with uploads_lock:
+        chunked_uploads.pop(upload_id, None)
+    return stored_upload(stored_name, duplicate)
+
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    upload = get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    with upload.lock:
+        upload.abort()
+    with uploads_lock:
+        chunked_uploads.pop(upload_id, None)
+    return jsonify({'uploadId': upload_id, 'state': 'aborted'})
 
 
 @app.route('/video/<path:filename>')
 def serve_video(filename):
+    storage.touch(os.path.join(UPLOAD_FOLDER, secure_filename(filename)))
     return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=False)
 
 
 @app.route('/download/<path:filename>')
 def download_output(filename):
+    storage.touch(os.path.join(OUTPUT_FOLDER, secure_filename(filename)))
     return send_from_directory(OUTPUT_FOLDER, filename, as_attachment=True)
 
 
-@app.route('/process', methods=['POST'])
-def process():
+@app.route('/preview', methods=['POST'])
+def preview():
     data = request.get_json(force=True)
     filename = data.get('filename')
     roi = data.get('roi')
-    method = data.get('method', 'telea')
-    quality = data.get('quality', 'ultra')
+    method = str(data.get('method') or 'telea').lower()
+    # One still per timestamp (seconds); clip adds a short low-res MP4 from clip.start
+    timestamps = data.get('timestamps', [data.get('time', 0)])
+    clip = data.get('clip')
+    max_width = data.get('maxWidth', 1280)
 
     if not filename or not roi:
         return jsonify({'error': 'filename and roi are required'}), 400
+    if method not in INPAINT_METHODS:
+        return jsonify({'error': f"method must be one of {', '.join(INPAINT_METHODS)}"}), 400
 
+    if not is_stored_name(filename):
+        return jsonify({'error': 'filename must be a name returned by /upload'}), 400
     input_path = os.path.join(UPLOAD_FOLDER, filename)
     if not os.path.exists(input_path):
         return jsonify({'error': 'File not found'}), 404
 
-    output_basename = f"processed_{uuid.uuid4().hex}.mp4"
-    frames_dir = os.path.join(TEMP_FOLDER, f"frames_{uuid.uuid4().hex}")
-    output_path = os.path.join(OUTPUT_FOLDER, output_basename)
-
     try:
-        fps = remove_watermark_roi_to_frames(
-            input_video_path=input_path,
-            output_frames_dir=frames_dir,
-            roi=(int(roi['x']), int(roi['y']), int(roi['width']), int(roi['height'])),
-            inpaint_method=method
-        )
-
-        width, height = probe_resolution(input_path)
-        scale_filter = build_scale_filter(width, height)
+        roi_box = (int(roi['x']), int(roi['y']), int(roi['width']), int(roi['height']))
+        times = [float(t) for t in timestamps][:8]
+        max_width = int(max_width) if max_width else None
+        clip_range = (float(clip.get('start', times[0] if times else 0)), float(clip.get('duration', 2))) if clip else None
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'roi must have integer x, y, width and height and timestamps must be seconds'}), 400
+
+    # Runs in the request thread: previews never wait behind /process jobs
+    storage.touch(input_path)
+    try:
+        frames = [
+            {'time': t, 'image': data_url(preview_frame(preview_frames.get(input_path, t), roi_box, method, max_width), 'image/jpeg')}
+            for t in times
+        ]
+        result = {'frames': frames}
+        if clip_range:
+            media = media_info(input_path)
+            result['clip'] = data_url(preview_clip(input_path, roi_box, *clip_range, method, temp_dir=TEMP_FOLDER,
+                                                   video_info=(media['width'], media['height'], media['fps'])), 'video/mp4')
+    except (RuntimeError, ValueError, KeyError) as exc:
+        return jsonify({'error': str(exc)}), 422
+    return jsonify(result)
 
-        encode_frames_and_mux(frames_dir, fps, input_path, output_path, quality, scale_filter)
 
-    except Exception as exc:
-        return jsonify({'error': str(exc)}), 500
-    finally:
-        try:
-            if os.path.isdir(frames_dir):
-                shutil.rmtree(frames_dir)
-        except Exception:
-            pass
+@app.route('/process', methods=['POST'])
+def process():
+    data = request.get_json(force=True)
+    filename = data.get('filename')
+    roi = data.get('roi')
+    method = str(data.get('method') or 'telea').lower()
+    quality = data.get('quality') or 'ultra'
+    # 'parallel' splits at keyframes across processes; 'stream' pipes raw frames
+    # into one ffmpeg; 'frames' keeps the PNG intermediate
+    pipeline = data.get('pipeline') or app.config['DEFAULT_PIPELINE']
+    decoder = data.get('decoder') or 'opencv'
+    # Reuse the previous inpainted patch while the pixels around the ROI stay
+    # within this many levels of it; 0 reuses only exact matches
+    reuse_tolerance = data.get('reuseTolerance', 0)
+    refresh_interval = data.get('refreshInterval', 0)
+    # Optional [{start, end}] in seconds; only GOPs overlapping them are re-encoded
+    ranges = data.get('ranges')
 
-    return jsonify({
-        'downloadUrl': f"/download/{output_basename}",
-        'outputFilename': output_basename
-    })
+    if not filename or not roi:
+        return jsonify({'error': 'filename and roi are required'}), 400
+    # These end up in metric labels and the cache key, so only known values are accepted
+    for name, value, allowed in (('pipeline', pipeline, PIPELINES), ('method', method, INPAINT_METHODS),
+                                 ('quality', quality, tuple(QUALITY_PRESETS)), ('decoder', decoder, DECODERS)):
+        if value not in allowed:
+            return jsonify({'error': f"{name} must be one of {', '.join(allowed)}"}), 400
+
+    if not is_stored_name(filename):
+        return jsonify({'error': 'filename must be a name returned by /upload'}), 400
+    input_path = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(input_path):
+        return jsonify({'error': 'File not found'}), 404
 
+    try:
+        roi_box = (int(roi['x']), int(roi['y']), int(roi['width']), int(roi['height']))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'roi must have integer x, y, width and height'}), 400
+    try:
+        reuse_tolerance = None if reuse_tolerance is None else int(reuse_tolerance)
+        refresh_interval = int(refresh_interval or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'reuseTolerance and refreshInterval must be integers'}), 400
+    cache_options = {'reuse_tolerance': reuse_tolerance, 'refresh_interval': refresh_interval}
+    try:
+        time_ranges = [(float(r['start']), float(r['end'])) for r in ranges] if ranges else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'ranges must be a list of {start, end} in seconds'}), 400
 
-def probe_resolution(path: str):
-    cmd = [
-        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of', 'json', path
-    ]
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if proc.returncode != 0:
-        return (1920, 1080)
+    # Probed once when the file was uploaded
     try:
-        info = json.loads(proc.stdout)
-        stream = info['streams'][0]
-        return (int(stream['width']), int(stream['height']))
-    except Exception:
-        return (1920, 1080)
-
-
-def build_scale_filter(src_w: int, src_h: int) -> str:
-    if src_h >= 2160:
-        return 'scale=iw:ih:flags=lanczos'
-    if src_h >= 1080:
-        return 'scale=iw:ih:flags=lanczos'
-    target_h = 1080
-    target_w = int(round(src_w * (target_h / src_h)))
-    if target_w % 2 == 1:
-        target_w += 1
-    return f'scale={target_w}:{target_h}:flags=lanczos'
-
-
-def encode_frames_and_mux(frames_dir: str, fps: float, source_with_audio: str, output_path: str, quality: str, scale_filter: str) -> None:
-    # Quality map: include ultra (lossless x264)
-    presets = {
-        'fast': ('veryfast', '23', None),
-        'balanced': ('medium', '20', None),
-        'better': ('slow', '18', None),
-        'best': ('veryslow', '16', None),
-        'ultra': ('placebo', None, '0')  # qp=0 lossless
-    }
-    preset, crf, qp = presets.get(quality, ('placebo', None, '0'))
-
-    pattern = os.path.join(frames_dir, 'frame_%06d.png')
-
-    cmd = [
-        'ffmpeg', '-y',
-        '-framerate', str(fps), '-i', pattern,
-        '-i', source_with_audio,
-        '-map', '0:v:0', '-map', '1:a:0?',
-        '-filter:v', scale_filter,
-        '-c:v', 'libx264', '-preset', preset,
-        '-pix_fmt', 'yuv420p',
-        '-color_primaries', 'bt709', '-color_trc', 'bt709', '-colorspace', 'bt709',
-        '-movflags', '+faststart',
-        '-c:a', 'aac', '-b:a', '192k',
-        output_path
-    ]
-    if qp is not None:
-        cmd[cmd.index('-pix_fmt')] = '-qp'
-        cmd[cmd.index('-qp') + 1:cmd.index('-qp') + 1] = [qp, '-pix_fmt']
-    else:
-        cmd[cmd.index('-c:v') + 4:cmd.index('-c:v') + 4] = ['-crf', crf]
-
-    run_ffmpeg(cmd)
-
-
-def run_ffmpeg(cmd: list) -> None:
-    env = os.environ.copy()
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, text=True)
-    if proc.returncode != 0:
-        raise RuntimeError(f"ffmpeg failed: {proc.stderr[:800]}")
+        media = media_info(input_path)
+    except (RuntimeError, ValueError, KeyError) as exc:
+        return jsonify({'error': f'Not a readable video: {exc}'}), 422
+    if time_ranges:
+        # Ends are inclusive, so the last frame may start up to one frame before the duration
+        duration = media['duration'] + 1.0 / media['fps'] if media['duration'] else float('inf')
+        if any(start < 0 or end <= start or end > duration for start, end in time_ranges):
+            return jsonify({'error': f"ranges need 0 <= start < end <= {media['duration']:g} (the duration in seconds)"}), 400
+    # The size frames decode to, i.e. after rotation: what the UI shows and draws the ROI on
+    width, height = media['width'], media['height']
+    scale_filter = build_scale_filter(width, height)
+    roi_box = clamp_roi(roi_box, width, height)
+    # Identical requests (e.g. retries after a timeout) share one output
+    key = result_key(content_hash(input_path), roi_box, method, quality, scale_filter, ranges=time_ranges,
+                     reuse_tolerance=reuse_tolerance or None, refresh_interval=(refresh_interval or None) if reuse_tolerance else None)
+    output_basename = f"processed_{key}.mp4"
+    output_path = os.path.join(OUTPUT_FOLDER, output_basename)
+    storage.touch(input_path)
+    if os.path.exists(output_path):
+        storage.touch(output_path)
+        return jsonify({
+            'state': 'done',
+            'cached': True,
+            'downloadUrl': f"/download/{output_basename}",
+            'outputFilename': output_basename
+        })
+    # Everything the job writes goes into its own temp dir, so its disk use can be measured.
+    # The output is moved into outputs/ only once complete, so a partial file is never a cache hit.
+    job_temp = os.path.join(TEMP_FOLDER, f"job_{uuid.uuid4().hex}")
+    partial_path = os.path.join(job_temp, output_basename)
+    workers = min(app.config['PROCESS_WORKERS'], job_queue.cpu_budget)
+
+    def run(job: Job) -> dict:
+        os.makedirs(job_temp, exist_ok=True)
+        try:
+            process_video(input_path, partial_path, roi_box, method, quality, scale_filter, pipeline, decoder,
+                          workers=workers, temp_dir=job_temp, time_ranges=time_ranges, progress=job.progress,
+                          timing=job.timing, cancel_event=job.cancel_event, fragmented=app.config['PROGRESSIVE_OUTPUT'],
+                          media=media, **cache_options)
+            os.replace(partial_path, output_path)
+        finally:
+            shutil.rmtree(job_temp, ignore_errors=True)
+
+        evict_storage(output_path)
+        inpainted = job.stages.get('inpaint', 0)
+        return {
+            'downloadUrl': f"/download/{output_basename}",
+            'outputFilename': output_basename,
+            'reuseHitRate': job.stages.get('reused', 0) / inpainted if inpainted else 0.0
+        }
+
+    # Rough number of cores each pipeline keeps busy, for admission control
+    cpus = workers if time_ranges else {'frames': 1, 'stream': 2}.get(pipeline, workers)
+    labels = {'pipeline': 'ranges' if time_ranges else pipeline, 'method': method, 'quality': quality}
+    # Only the stream pipeline writes the output from the first frame on; the others
+    # write it in their last encode or concat pass, so there is nothing to follow early
+    progressive = app.config['PROGRESSIVE_OUTPUT'] and pipeline == 'stream' and not time_ranges
+    job = Job(run, cpus=cpus, total_frames=media['frame_count'], stage_names=STAGES, temp_dir=job_temp, labels=labels,
+              live_output=partial_path if progressive else None)
+    try:
+        # An identical request may still be running; then this job is dropped unqueued
+        job = submit_once(key, job, input_path)
+    except QueueFull as exc:
+        return jsonify({'error': str(exc)}), 503
+
+    result = {'jobId': job.id, 'statusUrl': f"/jobs/{job.id}"}
+    if job.live_output:
+        result['outputUrl'] = f"/jobs/{job.id}/output"
+    return jsonify(result), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    data = job.to_dict()
+    data['queuePosition'] = job_queue.position(job)
+    return jsonify(data)
+
+
+@app.route('/jobs/<job_id>/output')
+def job_output(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.state == 'done':
+        return redirect(job.result['downloadUrl'])
+    if job.state in ('failed', 'cancelled'):
+        return jsonify({'error': job.error or 'Job cancelled'}), 409
+    path = job.live_output
+    if path is None:
+        return jsonify({'error': 'Output is only available once the job is done'}), 409
+
+    if request.range is not None:
+        # Serve the part written so far; the total length is not known yet
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            if job.state == 'done':
+                return redirect(job.result['downloadUrl'])
+            return Response(status=416, headers={'Content-Range': 'bytes */0'})
+        size = os.fstat(f.fileno()).st_size
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            f.close()
+            return Response(status=416, headers={'Content-Range': f"bytes */{size}"})
+        start, stop = byte_range
+        # Streamed: a <video> element asks for bytes=0-, i.e. everything written so far
+        return Response(read_range(f, start, stop), 206, mimetype='video/mp4',
+                        headers={'Content-Range': f"bytes {start}-{stop - 1}/*", 'Content-Length': str(stop - start),
+                                 'Accept-Ranges': 'bytes'})
+
+    def stream():
+        sent = 0
+        for chunk in follow_file(path, lambda: job.finished_at is not None):
+            sent += len(chunk)
+            yield chunk
+        if job.state != 'done':
+            # Abort the transfer so the client does not take a truncated file for a complete one
+            raise RuntimeError(job.error or 'Job cancelled')
+        if not sent:
+            # Finished and moved into outputs/ before the live file could be opened
+            yield from follow_file(os.path.join(OUTPUT_FOLDER, job.result['outputFilename']), lambda: True)
+
+    return Response(stream(), mimetype='video/mp4',
+                    headers={'Content-Disposition': f"attachment; filename={os.path.basename(path)}"})
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    queued = job.state == 'queued'
+    job_queue.cancel(job_id)
+    if queued and job.started_at is None:
+        # Dropped from the queue without running, so on_finish will not record it
+        job_metrics.record(job.to_dict())
+    return jsonify(job.to_dict())
+
+
+@app.route('/metrics')
+def metrics():
+    queued, running = job_queue.counts()
+    text = job_metrics.render([
+        ('watermark_jobs_queued', 'Jobs waiting in the queue.', queued),
+        ('watermark_jobs_running', 'Jobs currently running.', running),
+        ('watermark_storage_bytes', 'Bytes used by uploads and outputs.', storage.usage()),
+    ])
+    return Response(text, mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+"""Benchmark the watermark removal pipelines on synthetic videos.
+
+Generates test videos with ffmpeg's testsrc2 source and a burned-in logo, runs
+every resolution / duration / method / quality / pipeline combination through
+the same code as /process, and writes a JSON report. Each result is keyed by a
+stable case id so reports from different commits or machines can be compared.
+
+    python benchmark.py --resolutions 640x360,1280x720 --durations 2 --qualities fast,balanced -o report.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from utils.ffmpeg import QUALITY_PRESETS, build_scale_filter, probe_media, run_ffmpeg
+from utils.jobs import Job
+from utils.pipeline import STAGES
+from utils.process import PIPELINES, process_video
+
+
+def logo_box(width: int, height: int) -> Tuple[int, int, int, int]:
+    """Top-right (x, y, w, h) of the burned-in logo, which is also the ROI to remove."""
+    w, h = width // 6 // 2 * 2, height // 10 // 2 * 2
+    margin = height // 30
+    return width - w - margin, margin, w, h
+
+
+def generate_video(path: str, width: int, height: int, duration: float, fps: float, logo: bool) -> None:
+    """Write a testsrc2 clip with a sine audio track, optionally with a semi-transparent logo."""
+    x, y, w, h = logo_box(width, height)
+    video_filter = (f'drawbox=x={x}:y={y}:w={w}:h={h}:color=white@0.6:t=fill,'
+                    f'drawbox=x={x + w // 4}:y={y + h // 4}:w={w // 2}:h={h // 2}:color=red@0.8:t=fill') if logo else 'null'
+    run_ffmpeg([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-filter:v', video_filter,
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-g', str(int(fps * 2)), '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        path
+    ])
+
+
+def roi_psnr(output_path: str, reference_path: str, roi: Tuple[int, int, int, int]) -> float:
+    """Mean PSNR of roi between the output and the logo-free reference.
+
+    Output frames are scaled back to the reference size first, since small
+    sources are upscaled on encode.
+    """
+    x, y, w, h = roi
+    out, ref = cv2.VideoCapture(output_path), cv2.VideoCapture(reference_path)
+    errors = []
+    try:
+        while True:
+            ok_out, frame_out = out.read()
+            ok_ref, frame_ref = ref.read()
+            if not (ok_out and ok_ref):
+                break
+            if frame_out.shape != frame_ref.shape:
+                frame_out = cv2.resize(frame_out, (frame_ref.shape[1], frame_ref.shape[0]), interpolation=cv2.INTER_AREA)
+            diff = frame_out[y:y + h, x:x + w].astype(np.float32) - frame_ref[y:y + h, x:x + w].astype(np.float32)
+            errors.append(float(np.mean(diff * diff)))
+    finally:
+        out.release()
+        ref.release()
+    if not errors:
+        return 0.0
+    mse = sum(errors) / len(errors)
+    # Capped like most tools so identical frames still give a number
+    return 100.0 if mse == 0 else min(100.0, 10 * math.log10(255.0 ** 2 / mse))
+
+
+def run_case(source: str, media: dict, reference: str, work_dir: str, method: str, quality: str, pipeline: str, workers: int) -> dict:
+    """Run one case on source, whose probe_media record is media, the way a /process job would.
+
+    Outputs are fragmented MP4, as with /process's default PROGRESSIVE_OUTPUT.
+    """
+    width, height = media['width'], media['height']
+    roi = logo_box(width, height)
+    job_temp = tempfile.mkdtemp(dir=work_dir)
+    output_path = os.path.join(work_dir, f'output_{method}_{quality}_{pipeline}.mp4')
+
+    def target(job: Job) -> dict:
+        process_video(source, os.path.join(job_temp, 'output.mp4'), roi, method, quality, build_scale_filter(width, height),
+                      pipeline, workers=workers, temp_dir=job_temp, progress=job.progress, timing=job.timing, media=media,
+                      fragmented=True)
+        os.replace(os.path.join(job_temp, 'output.mp4'), output_path)
+        return {}
+
+    job = Job(target, stage_names=STAGES, temp_dir=job_temp)
+    try:
+        job.run()
+    finally:
+        shutil.rmtree(job_temp, ignore_errors=True)
+    result = job.to_dict()
+    report = {
+        'state': result['state'],
+        'seconds': result['finishedAt'] - result['startedAt'],
+        'frames': result['stages'].get('encode', {}).get('frames', 0),
+        'fps': result['fps'],
+        'timings': result['timings'],
+        'peakRss': result['peakRss'],
+        'peakTempBytes': result['peakTempBytes'],
+    }
+    if result['state'] != 'done':
+        report['error'] = result.get('error')
+        return report
+    report['outputBytes'] = os.path.getsize(output_path)
+    report['psnrRoi'] = roi_psnr(output_path, reference, roi)
+    os.remove(output_path)
+    return report
+
+
+def ffmpeg_version() -> str:
+    try:
+        proc = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return proc.stdout.splitlines()[0] if proc.stdout else 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def parse_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark watermark removal on synthetic videos.')
+    parser.add_argument('--resolutions', default='640x360,1280x720,1920x1080', help='comma-separated WxH list')
+    parser.add_argument('--durations', default='2,10', help='comma-separated seconds')
+    parser.add_argument('--fps', type=float, default=25.0)
+    parser.add_argument('--methods', default='telea,ns')
+    parser.add_argument('--qualities', default=','.join(QUALITY_PRESETS))
+    parser.add_argument('--pipelines', default=','.join(PIPELINES))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes for the parallel pipeline')
+    parser.add_argument('--work-dir', help='where test videos and outputs go (default: a temp dir, removed afterwards)')
+    parser.add_argument('-o', '--output', help='report path (default: stdout)')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='wm_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    try:
+        for resolution in parse_list(args.resolutions):
+            width, height = (int(v) for v in resolution.lower().split('x'))
+            for duration in (float(d) for d in parse_list(args.durations)):
+                source = os.path.join(work_dir, f'source_{width}x{height}_{duration:g}s.mp4')
+                reference = os.path.join(work_dir, f'reference_{width}x{height}_{duration:g}s.mp4')
+                generate_video(source, width, height, duration, args.fps, logo=True)
+                generate_video(reference, width, height, duration, args.fps, logo=False)
+                # Probed once, like an upload; /process jobs never probe the file again
+                media = probe_media(source)
+                for method in parse_list(args.methods):
+                    for quality in parse_list(args.qualities):
+                        for pipeline in parse_list(args.pipelines):
+                            case = f'{width}x{height}-{duration:g}s-{method}-{quality}-{pipeline}'
+                            print(f'{case} ...', file=sys.stderr, flush=True)
+                            result = run_case(source, media, reference, work_dir, method, quality, pipeline, args.workers)
+                            results.append({'case': case, 'resolution': [width, height], 'duration': duration, 'method': method,
+                                            'quality': quality, 'pipeline': pipeline, **result})
+                            print(f'{case}: {result["state"]} in {result["seconds"]:.2f}s', file=sys.stderr, flush=True)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'createdAt': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpuCount': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'ffmpeg': ffmpeg_version(),
+        },
+        'config': {'fps': args.fps, 'workers': args.workers},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
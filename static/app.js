@@ -13,9 +13,16 @@ const overlayHelp = document.getElementById('overlayHelp');
 const methodSelect = document.getElementById('method');
 const qualitySelect = document.getElementById('quality');
 const clearRoiBtn = document.getElementById('clearRoi');
+const previewClipBtn = document.getElementById('previewClipBtn');
+const previewPane = document.getElementById('previewPane');
+const previewImage = document.getElementById('previewImage');
+const previewClip = document.getElementById('previewClip');
+const previewStatus = document.getElementById('previewStatus');
 const processBtn = document.getElementById('processBtn');
 const processStatus = document.getElementById('processStatus');
 const processProgress = document.getElementById('processProgress');
+const processProgressBar = document.getElementById('processProgressBar');
+const cancelBtn = document.getElementById('cancelBtn');
 const downloadLink = document.getElementById('downloadLink');
 const toasts = document.getElementById('toasts');
 
@@ -23,6 +30,9 @@ let uploadedFilename = null;
 let isDrawing = false;
 let startX = 0, startY = 0;
 let roi = null; // {x, y, width, height}
+let currentJobId = null;
+let previewTimer = null;
+let previewSeq = 0;
 
 // Toasts
 function toast(message, type = 'success', timeout = 2500) {
@@ -90,7 +100,7 @@ function drawOverlay() {
 window.addEventListener('resize', () => { fitCanvasToVideo(); drawOverlay(); });
 video.addEventListener('loadedmetadata', () => { fitCanvasToVideo(); overlayHelp.style.display = 'block'; processBtn.disabled = !uploadedFilename; });
 
-// Upload with progress (XHR for progress events)
+// Resumable chunked upload (XHR per chunk for progress events)
 uploadBtn.addEventListener('click', async () => {
   const file = fileInput.files && fileInput.files[0];
   if (!file) { toast('Select a video first', 'error'); return; }
@@ -98,15 +108,13 @@ uploadBtn.addEventListener('click', async () => {
   uploadProgressBar.style.width = '0%';
   uploadBtn.disabled = true;
 
-  const form = new FormData();
-  form.append('video', file);
-
   try {
-    const data = await uploadWithProgress('/upload', form, (pct) => {
+    const data = await uploadResumable(file, (pct) => {
       uploadProgressBar.style.width = `${pct}%`;
     });
     uploadedFilename = data.filename;
     video.src = data.videoUrl;
+    previewPane.hidden = true;
     toast('Uploaded successfully');
     processBtn.disabled = false;
   } catch (e) {
@@ -117,27 +125,83 @@ uploadBtn.addEventListener('click', async () => {
   }
 });
 
-function uploadWithProgress(url, form, onProgress) {
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+const UPLOAD_RETRIES = 5;
+
+async function uploadResumable(file, onProgress) {
+  // Picking the same file again, e.g. after a reload, continues its unfinished upload
+  const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+  let upload = null;
+  const savedId = localStorage.getItem(resumeKey);
+  if (savedId) {
+    const res = await fetch(`/uploads/${savedId}`);
+    if (res.ok) upload = await res.json();
+  }
+  if (!upload) {
+    const res = await fetch('/uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    upload = await res.json();
+    if (!res.ok) throw new Error(upload.error || 'Upload failed');
+    localStorage.setItem(resumeKey, upload.uploadId);
+  }
+
+  const url = `/uploads/${upload.uploadId}`;
+  const chunkSize = upload.chunkSize || UPLOAD_CHUNK_SIZE;
+  let offset = upload.offset;
+  let failures = 0;
+  while (true) {
+    const start = offset;
+    const end = Math.min(start + chunkSize, file.size);
+    let res;
+    try {
+      res = await putChunk(url, file.slice(start, end), start, file.size, (loaded) => {
+        onProgress(Math.round(((start + loaded) / file.size) * 100));
+      });
+    } catch (e) {
+      if (++failures > UPLOAD_RETRIES) throw e;
+      // Back off, then ask the server how much of the chunk arrived
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** (failures - 1)));
+      try {
+        const status = await fetch(url);
+        if (status.ok) offset = (await status.json()).offset;
+      } catch {
+        // Still offline; the next attempt retries from the same offset
+      }
+      continue;
+    }
+    failures = 0;
+    if (res.status === 409) { offset = res.data.offset; continue; }
+    if (res.status < 200 || res.status >= 300) {
+      localStorage.removeItem(resumeKey);
+      throw new Error(res.data.error || 'Upload failed');
+    }
+    if (res.data.filename) {
+      localStorage.removeItem(resumeKey);
+      return res.data;
+    }
+    offset = res.data.offset;
+  }
+}
+
+function putChunk(url, blob, start, total, onProgress) {
   return new Promise((resolve, reject) => {
     const xhr = new XMLHttpRequest();
-    xhr.open('POST', url);
-    xhr.upload.onprogress = (e) => {
-      if (e.lengthComputable) {
-        const pct = Math.round((e.loaded / e.total) * 100);
-        onProgress(pct);
-      }
-    };
+    xhr.open('PUT', url);
+    xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+    xhr.setRequestHeader('Content-Range', `bytes ${start}-${start + blob.size - 1}/${total}`);
+    xhr.upload.onprogress = (e) => onProgress(e.loaded);
     xhr.onload = () => {
       try {
-        const data = JSON.parse(xhr.responseText);
-        if (xhr.status >= 200 && xhr.status < 300) resolve(data);
-        else reject(new Error(data.error || 'Upload failed'));
+        resolve({ status: xhr.status, data: JSON.parse(xhr.responseText) });
       } catch {
         reject(new Error('Invalid server response'));
       }
     };
     xhr.onerror = () => reject(new Error('Network error'));
-    xhr.send(form);
+    xhr.send(blob);
   });
 }
 
@@ -174,18 +238,66 @@ overlay.addEventListener('mousemove', (e) => {
   drawOverlay();
 });
 
-overlay.addEventListener('mouseup', () => { isDrawing = false; });
-clearRoiBtn.addEventListener('click', () => { roi = null; drawOverlay(); overlayHelp.style.display = 'block'; });
+overlay.addEventListener('mouseup', () => { isDrawing = false; schedulePreview(); });
+clearRoiBtn.addEventListener('click', () => {
+  roi = null; drawOverlay(); overlayHelp.style.display = 'block';
+  previewPane.hidden = true; previewClipBtn.disabled = true;
+});
+
+// Preview: inpaint the current frame whenever the ROI, method or position changes
+function hasRoi() {
+  return uploadedFilename && roi && roi.width > 0 && roi.height > 0;
+}
+
+function schedulePreview() {
+  previewClipBtn.disabled = !hasRoi();
+  if (!hasRoi()) return;
+  clearTimeout(previewTimer);
+  previewTimer = setTimeout(() => requestPreview(false), 150);
+}
+
+async function requestPreview(withClip) {
+  const seq = ++previewSeq;
+  const time = video.currentTime || 0;
+  const body = { filename: uploadedFilename, roi, method: methodSelect.value, timestamps: [time] };
+  if (withClip) body.clip = { start: time, duration: 2 };
+  previewStatus.textContent = withClip ? 'Rendering clip...' : 'Updating preview...';
+  try {
+    const res = await fetch('/preview', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(body)
+    });
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.error || 'Preview failed');
+    // Ignore responses overtaken by a newer request
+    if (seq !== previewSeq) return;
+    previewPane.hidden = false;
+    previewImage.src = data.frames[0].image;
+    previewImage.hidden = !!data.clip;
+    previewClip.hidden = !data.clip;
+    if (data.clip) { previewClip.src = data.clip; previewClip.play(); }
+    previewStatus.textContent = `Preview at ${time.toFixed(2)}s`;
+  } catch (e) {
+    if (seq === previewSeq) previewStatus.textContent = e.message || 'Preview failed';
+  }
+}
+
+methodSelect.addEventListener('change', schedulePreview);
+video.addEventListener('seeked', schedulePreview);
+previewClipBtn.addEventListener('click', () => { if (hasRoi()) requestPreview(true); });
 
 // Process
 processBtn.addEventListener('click', async () => {
   if (!uploadedFilename) { toast('Upload a video first', 'error'); return; }
   if (!roi || roi.width <= 0 || roi.height <= 0) { toast('Draw a rectangle over the watermark', 'error'); return; }
 
-  processStatus.textContent = 'Processing...';
+  processStatus.textContent = 'Queued...';
   processProgress.hidden = false;
+  processProgressBar.style.width = '0%';
   downloadLink.innerHTML = '';
   processBtn.disabled = true;
+  cancelBtn.hidden = false;
 
   try {
     const res = await fetch('/process', {
@@ -193,9 +305,29 @@ processBtn.addEventListener('click', async () => {
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ filename: uploadedFilename, roi, method: methodSelect.value, quality: qualitySelect.value || 'ultra' })
     });
-    const data = await res.json();
-    if (!res.ok) throw new Error(data.error || 'Processing failed');
+    const job = await res.json();
+    if (!res.ok) throw new Error(job.error || 'Processing failed');
+    currentJobId = job.jobId;
+    if (job.outputUrl) {
+      // Given for the stream pipeline, the server default while progressive output is on:
+      // its fragmented output can be downloaded while it is still being encoded
+      const live = document.createElement('a');
+      live.href = job.outputUrl;
+      live.textContent = 'Download while encoding';
+      live.className = 'btn';
+      downloadLink.appendChild(live);
+    }
+    // An identical earlier request already produced this output
+    const data = job.state === 'done' ? job : await pollJob(job.statusUrl);
+    downloadLink.innerHTML = '';
+    if (data.state === 'cancelled') {
+      processStatus.textContent = 'Cancelled';
+      toast('Processing cancelled');
+      return;
+    }
+    if (data.state !== 'done') throw new Error(data.error || 'Processing failed');
     processStatus.textContent = 'Done';
+    processProgressBar.style.width = '100%';
     const a = document.createElement('a');
     a.href = data.downloadUrl;
     a.textContent = 'Download processed video';
@@ -204,10 +336,51 @@ processBtn.addEventListener('click', async () => {
     downloadLink.appendChild(a);
     toast('Processing complete');
   } catch (e) {
+    downloadLink.innerHTML = '';
     processStatus.textContent = 'Error';
     toast(e.message || 'Processing failed', 'error');
   } finally {
-    processProgress.hidden = true;
+    currentJobId = null;
+    setTimeout(() => { processProgress.hidden = true; }, 500);
     processBtn.disabled = false;
+    cancelBtn.hidden = true;
+  }
+});
+
+cancelBtn.addEventListener('click', async () => {
+  if (!currentJobId) return;
+  cancelBtn.disabled = true;
+  try {
+    await fetch(`/jobs/${currentJobId}`, { method: 'DELETE' });
+  } finally {
+    cancelBtn.disabled = false;
   }
 });
+
+// Poll job status until it finishes, updating the progress bar
+async function pollJob(statusUrl) {
+  while (true) {
+    const res = await fetch(statusUrl);
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.error || 'Job lookup failed');
+    if (['done', 'failed', 'cancelled'].includes(data.state)) return data;
+    processStatus.textContent = describeJob(data);
+    await new Promise(r => setTimeout(r, 1000));
+  }
+}
+
+function describeJob(data) {
+  if (data.state === 'queued') {
+    return data.queuePosition ? `Queued (${data.queuePosition} ahead)` : 'Queued...';
+  }
+  const encoded = (data.stages.encode && data.stages.encode.frames) || 0;
+  const total = data.totalFrames || 0;
+  if (!total) return 'Processing...';
+  const pct = Math.min(100, Math.round((encoded / total) * 100));
+  processProgressBar.style.width = `${pct}%`;
+  const eta = data.eta != null ? ` · ~${Math.ceil(data.eta)}s left` : '';
+  const inpainted = (data.stages.inpaint && data.stages.inpaint.frames) || 0;
+  const reused = (data.counters && data.counters.reused) || 0;
+  const reuse = inpainted ? ` · ${Math.round((reused / inpainted) * 100)}% reused` : '';
+  return `Processing ${encoded}/${total} frames (${pct}%)${eta}${reuse}`;
+}
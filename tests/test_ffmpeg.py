@@ -0,0 +1,55 @@
+import json
+import subprocess
+
+import pytest
+
+from utils import ffmpeg
+from utils.ffmpeg import probe_media
+
+
+def fake_ffprobe(monkeypatch, output):
+    def run(cmd, **kwargs):
+        return subprocess.CompletedProcess(cmd, 0, stdout=json.dumps(output), stderr='')
+    monkeypatch.setattr(ffmpeg.subprocess, 'run', run)
+
+
+def probe_output(packets):
+    video = {'index': 0, 'codec_type': 'video', 'codec_name': 'h264', 'pix_fmt': 'yuv420p', 'width': 640, 'height': 360,
+             'avg_frame_rate': '10/1'}
+    return {
+        'streams': [video, {'index': 1, 'codec_type': 'audio'}],
+        'format': {'start_time': '0.100000', 'duration': '0.400000'},
+        'packets': [dict(packet, stream_index=0) for packet in packets] + [{'stream_index': 1, 'pts_time': '0.1'}],
+    }
+
+
+def test_probe_media_indexes_keyframes(monkeypatch):
+    fake_ffprobe(monkeypatch, probe_output([
+        {'pts_time': '0.1', 'flags': 'K_'}, {'pts_time': '0.3', 'flags': '__'},
+        {'pts_time': '0.2', 'flags': '__'}, {'pts_time': '0.4', 'flags': 'K_'},
+    ]))
+
+    media = probe_media('video.mp4')
+
+    assert (media['width'], media['height'], media['fps'], media['has_audio']) == (640, 360, 10.0, True)
+    assert media['frame_count'] == 4
+    assert media['gops'] == [(0.0, 3), (pytest.approx(0.3), 1)]
+
+
+def test_probe_media_accepts_packets_without_timestamps(monkeypatch):
+    # The AVI demuxer leaves pts unset for streams with B-frames
+    fake_ffprobe(monkeypatch, probe_output([{'flags': 'K_'}, {'flags': '__'}, {'pts_time': '0.3', 'flags': '__'}]))
+
+    media = probe_media('video.avi')
+
+    assert media['frame_count'] == 3
+    assert media['packets'] is None and media['gops'] is None
+    json.dumps(media)
+
+
+def test_probe_media_rejects_files_without_video_packets(monkeypatch):
+    fake_ffprobe(monkeypatch, probe_output([]))
+
+    with pytest.raises(RuntimeError):
+        probe_media('video.mp4')
+
@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+from utils.jobs import Job, JobQueue, QueueFull
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+class Blocking:
+    """A job target that runs until released, recording when it ran."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.calls = 0
+
+    def __call__(self, job):
+        self.calls += 1
+        self.started.set()
+        while not self.release.wait(0.01):
+            if job.cancel_event.is_set():
+                raise RuntimeError('Processing cancelled')
+        return {}
+
+
+def submit(queue, cpus):
+    target = Blocking()
+    return queue.submit(Job(target, cpus=cpus)), target
+
+
+def test_jobs_over_the_cpu_budget_do_not_overlap():
+    queue = JobQueue(workers=2, cpu_budget=4)
+    first, first_target = submit(queue, 3)
+    first_target.started.wait(5)
+    second, second_target = submit(queue, 2)
+
+    time.sleep(0.1)
+    assert (first.state, second.state) == ('running', 'queued')
+    assert queue.counts() == (1, 1)
+
+    first_target.release.set()
+    assert second_target.started.wait(5)
+    assert first.state == 'done'
+    second_target.release.set()
+    wait_for(lambda: second.state == 'done')
+
+
+def test_head_of_queue_is_not_skipped():
+    queue = JobQueue(workers=3, cpu_budget=4)
+    first, first_target = submit(queue, 3)
+    first_target.started.wait(5)
+    head, head_target = submit(queue, 2)
+    # Fits in the remaining budget, but must wait behind the head
+    small, small_target = submit(queue, 1)
+
+    time.sleep(0.1)
+    assert (head.state, small.state) == ('queued', 'queued')
+    assert queue.position(head) == 0 and queue.position(small) == 1
+
+    first_target.release.set()
+    assert head_target.started.wait(5)
+    assert small_target.started.wait(5)
+    head_target.release.set()
+    small_target.release.set()
+    wait_for(lambda: head.state == small.state == 'done')
+
+
+def test_job_larger_than_the_budget_runs_alone():
+    queue = JobQueue(workers=2, cpu_budget=2)
+    big, big_target = submit(queue, 8)
+
+    assert big_target.started.wait(5)
+    big_target.release.set()
+    wait_for(lambda: big.state == 'done')
+
+
+def test_cancel_queued_job_never_runs_it():
+    finished = []
+    queue = JobQueue(workers=1, cpu_budget=1, on_finish=finished.append)
+    first, first_target = submit(queue, 1)
+    first_target.started.wait(5)
+    queued, queued_target = submit(queue, 1)
+
+    assert queue.cancel(queued.id) is queued
+    assert queued.state == 'cancelled' and queued.finished_at is not None
+    assert queue.counts() == (0, 1)
+
+    first_target.release.set()
+    wait_for(lambda: finished == [first])
+    time.sleep(0.1)
+    assert queued_target.calls == 0
+    assert queued.state == 'cancelled'
+
+
+def test_cancel_running_job():
+    finished = []
+    queue = JobQueue(workers=1, on_finish=finished.append)
+    job, target = submit(queue, 1)
+    target.started.wait(5)
+
+    queue.cancel(job.id)
+
+    wait_for(lambda: finished == [job])
+    assert job.state == 'cancelled'
+    assert 'error' not in job.to_dict()
+    assert queue.cancel('unknown') is None
+
+
+def test_submit_refuses_jobs_past_max_queued():
+    queue = JobQueue(workers=1, cpu_budget=1, max_queued=1)
+    first, first_target = submit(queue, 1)
+    first_target.started.wait(5)
+    second, second_target = submit(queue, 1)
+
+    with pytest.raises(QueueFull):
+        submit(queue, 1)
+
+    first_target.release.set()
+    second_target.release.set()
+    wait_for(lambda: second.state == 'done')
+
+
+def test_eta_waits_for_every_stage():
+    job = Job(lambda job: {}, total_frames=100, stage_names=('decode', 'inpaint', 'encode'))
+    job.state, job.started_at = 'running', time.time() - 10
+    job.progress('decode', 100)
+    job.progress('inpaint', 100)
+
+    assert job.eta() is None
+
+    job.progress('encode', 50)
+    assert job.eta() == pytest.approx(10, abs=1)
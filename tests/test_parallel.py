@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.ffmpeg import split_gops
+from utils.parallel import plan_segments
+
+
+def test_plan_segments_merges_gops_into_even_runs():
+    gops = [(0.0, 10), (1.0, 10), (2.0, 10), (3.0, 10)]
+
+    assert plan_segments(gops, 2) == [(0.0, 20), (2.0, 20)]
+
+
+def test_plan_segments_never_splits_a_gop():
+    gops = [(0.0, 50), (2.0, 5), (2.2, 5)]
+
+    # 7 frames per segment: the long GOP stays whole, the short ones are merged
+    assert plan_segments(gops, 8) == [(0.0, 50), (2.0, 10)]
+    assert plan_segments(gops, 1) == [(0.0, 60)]
+
+
+def test_split_gops_counts_frames_per_keyframe():
+    packets = [(1.0, True), (1.04, False), (1.08, False), (1.12, True), (1.16, False)]
+
+    gops = split_gops(1.0, packets)
+
+    assert [count for _, count in gops] == [3, 2]
+    assert gops[0][0] == 0.0
+    assert gops[1][0] == pytest.approx(0.12)
+
+
+def test_split_gops_folds_leading_frames_into_first_gop():
+    # A B-frame shown before the first keyframe, and a stream starting after zero
+    packets = [(0.56, False), (0.6, True), (0.64, False), (0.68, True)]
+
+    gops = split_gops(0.5, packets)
+
+    assert gops == [(0.0, 3), (pytest.approx(0.18), 1)]
+
+
+def test_split_gops_without_keyframes_is_one_gop():
+    assert split_gops(0.0, [(0.0, False), (0.04, False)]) == [(0.0, 2)]
+
+
+def read_frames(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                return frames
+            frames.append(frame)
+    finally:
+        cap.release()
+
+
+@pytest.mark.skipif(not (shutil.which('ffmpeg') and shutil.which('ffprobe')), reason='needs ffmpeg and ffprobe')
+def test_parallel_output_matches_frames_pipeline(tmp_path):
+    from benchmark import generate_video, logo_box
+    from utils.process import process_video
+
+    # 10 fps with a 2 s GOP: three keyframe segments
+    source = str(tmp_path / 'source.mp4')
+    generate_video(source, 320, 180, 6, 10, logo=True)
+    roi = logo_box(320, 180)
+    scale_filter = 'scale=iw:ih:flags=lanczos'
+
+    outputs = {}
+    for pipeline in ('frames', 'parallel'):
+        outputs[pipeline] = str(tmp_path / f'{pipeline}.mp4')
+        process_video(source, outputs[pipeline], roi, 'telea', 'ultra', scale_filter, pipeline, workers=2,
+                      temp_dir=str(tmp_path))
+
+    serial, parallel = read_frames(outputs['frames']), read_frames(outputs['parallel'])
+    assert len(serial) == 60
+    assert len(parallel) == len(serial)
+    for index, (expected, actual) in enumerate(zip(serial, parallel)):
+        assert np.array_equal(expected, actual), f'frame {index} differs'
+    assert not [name for name in os.listdir(tmp_path) if name not in ('source.mp4', 'frames.mp4', 'parallel.mp4')]
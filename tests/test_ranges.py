@@ -0,0 +1,40 @@
+from utils.ranges import _shift, frame_ranges, plan_runs
+
+
+FRAME_TIMES = [i / 10 for i in range(10)]
+GOPS = [(0.0, 10), (1.0, 10), (2.0, 10), (3.0, 10)]
+
+
+def test_frame_ranges_include_both_ends():
+    assert frame_ranges(FRAME_TIMES, [(0.2, 0.4)]) == [(2, 5)]
+
+
+def test_frame_ranges_drop_ranges_between_frames():
+    assert frame_ranges(FRAME_TIMES, [(0.25, 0.28), (0.5, 0.5)]) == [(5, 6)]
+
+
+def test_frame_ranges_clip_to_the_last_frame():
+    assert frame_ranges(FRAME_TIMES, [(0.85, 5.0), (3.0, 4.0)]) == [(9, 10)]
+
+
+def test_plan_runs_marks_gops_that_overlap_active_frames():
+    runs = plan_runs(GOPS, [(12, 15)])
+
+    assert runs == [(False, [GOPS[0]], 0), (True, [GOPS[1]], 10), (False, GOPS[2:], 20)]
+
+
+def test_plan_runs_treats_gop_bounds_as_half_open():
+    assert [dirty for dirty, _, _ in plan_runs(GOPS, [(10, 20)])] == [False, True, False]
+    assert plan_runs(GOPS, [(9, 11), (30, 31)]) == [(True, GOPS[:2], 0), (False, [GOPS[2]], 20), (True, [GOPS[3]], 30)]
+
+
+def test_plan_runs_without_active_ranges_copies_everything():
+    assert plan_runs(GOPS, []) == [(False, GOPS, 0)]
+
+
+def test_shift_clips_ranges_to_the_segment():
+    active = [(5, 15), (18, 25), (25, 30)]
+
+    assert _shift(active, 10, 10) == [(0, 5), (8, 10)]
+    assert _shift([(0, 100)], 10, 10) == [(0, 10)]
+    assert _shift(active, 30, 10) == []
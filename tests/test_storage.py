@@ -0,0 +1,199 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from utils.storage import (ChunkedUpload, DiskLru, UploadConflict, follow_file, is_stored_name, read_range, result_key,
+                           save_hashed)
+
+
+ROI = (10, 20, 30, 40)
+
+
+def test_result_key_is_stable_and_ignores_unset_options():
+    key = result_key('ab' * 32, ROI, 'telea', 'ultra', 'scale=iw:ih')
+
+    assert len(key) == 32
+    assert result_key('ab' * 32, ROI, 'TELEA', 'ultra', 'scale=iw:ih', ranges=None) == key
+
+
+def test_result_key_changes_with_anything_that_changes_the_output():
+    key = result_key('ab' * 32, ROI, 'telea', 'ultra', 'scale=iw:ih')
+
+    assert result_key('cd' * 32, ROI, 'telea', 'ultra', 'scale=iw:ih') != key
+    assert result_key('ab' * 32, (10, 20, 30, 41), 'telea', 'ultra', 'scale=iw:ih') != key
+    assert result_key('ab' * 32, ROI, 'ns', 'ultra', 'scale=iw:ih') != key
+    assert result_key('ab' * 32, ROI, 'telea', 'fast', 'scale=iw:ih') != key
+    assert result_key('ab' * 32, ROI, 'telea', 'ultra', 'scale=1920:1080') != key
+    assert result_key('ab' * 32, ROI, 'telea', 'ultra', 'scale=iw:ih', ranges=[[1.0, 2.0]]) != key
+
+
+def test_save_hashed_names_files_by_content_and_drops_duplicates(tmp_path):
+    data = b'video bytes'
+
+    name, existed = save_hashed(io.BytesIO(data), str(tmp_path), '.mp4')
+    again, existed_again = save_hashed(io.BytesIO(data), str(tmp_path), '.mp4')
+
+    assert name == hashlib.sha256(data).hexdigest() + '.mp4'
+    assert (again, existed, existed_again) == (name, False, True)
+    assert os.listdir(tmp_path) == [name]
+
+
+def write(path, size, mtime):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_disk_lru_evicts_least_recently_used_first(tmp_path):
+    uploads, outputs = tmp_path / 'uploads', tmp_path / 'outputs'
+    uploads.mkdir()
+    outputs.mkdir()
+    oldest = write(uploads / 'a.mp4', 100, 1000)
+    older = write(outputs / 'b.mp4', 100, 2000)
+    newest = write(uploads / 'c.mp4', 100, 3000)
+    write(uploads / '.partial_upload', 500, 0)
+    lru = DiskLru([str(uploads), str(outputs)], max_bytes=150)
+
+    assert lru.usage() == 300
+    assert lru.evict() == [oldest, older]
+    assert os.path.exists(newest)
+    assert os.path.exists(uploads / '.partial_upload')
+
+
+def test_disk_lru_touch_and_keep_protect_files(tmp_path):
+    first = write(tmp_path / 'a.mp4', 100, 1000)
+    second = write(tmp_path / 'b.mp4', 100, 2000)
+    third = write(tmp_path / 'c.mp4', 100, 3000)
+    lru = DiskLru([str(tmp_path)], max_bytes=200)
+
+    lru.touch(first)
+
+    assert lru.evict(keep=[second]) == [third]
+    assert sorted(os.listdir(tmp_path)) == ['a.mp4', 'b.mp4']
+
+
+DATA = bytes(range(256)) * 10
+STORED_NAME = hashlib.sha256(DATA).hexdigest() + '.mp4'
+
+
+def test_chunked_upload_resumes_after_a_restart(tmp_path):
+    upload = ChunkedUpload.create(str(tmp_path), len(DATA), '.mp4')
+    assert upload.write(io.BytesIO(DATA[:1000]), 0) == 1000
+
+    # A fresh instance has no running hash, so finish() rehashes from disk
+    resumed = ChunkedUpload.open(str(tmp_path), upload.upload_id)
+    assert (resumed.size, resumed.ext, resumed.offset) == (len(DATA), '.mp4', 1000)
+    assert resumed.write(io.BytesIO(DATA[1000:]), 1000) == len(DATA)
+
+    assert resumed.finish() == (STORED_NAME, False)
+    assert os.listdir(tmp_path) == [STORED_NAME]
+    with open(tmp_path / STORED_NAME, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_chunked_upload_rejects_chunks_that_do_not_continue_it(tmp_path):
+    upload = ChunkedUpload.create(str(tmp_path), len(DATA), '.mp4')
+    upload.write(io.BytesIO(DATA[:100]), 0)
+
+    with pytest.raises(UploadConflict) as conflict:
+        upload.write(io.BytesIO(DATA[50:]), 50)
+    assert conflict.value.offset == 100
+    with pytest.raises(RuntimeError):
+        upload.write(io.BytesIO(DATA[100:] + b'extra'), 100)
+    with pytest.raises(RuntimeError):
+        ChunkedUpload.create(str(tmp_path), 10, '.mp4').finish()
+
+
+def test_chunked_upload_of_stored_content_is_deduplicated(tmp_path):
+    save_hashed(io.BytesIO(DATA), str(tmp_path), '.mp4')
+    upload = ChunkedUpload.create(str(tmp_path), len(DATA), '.mp4')
+    upload.write(io.BytesIO(DATA), 0)
+
+    assert upload.finish() == (STORED_NAME, True)
+    assert os.listdir(tmp_path) == [STORED_NAME]
+
+
+def test_chunked_upload_open_ignores_unknown_ids(tmp_path):
+    upload = ChunkedUpload.create(str(tmp_path), 10, '.mp4')
+    upload.abort()
+
+    assert ChunkedUpload.open(str(tmp_path), upload.upload_id) is None
+    assert ChunkedUpload.open(str(tmp_path), '../' + upload.upload_id) is None
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('name, stored', [
+    (STORED_NAME, True),
+    ('a' * 64 + '.mov', True),
+    ('../' + STORED_NAME, False),
+    ('/etc/passwd', False),
+    ('.partial_' + 'a' * 32, False),
+    ('A' * 64 + '.mp4', False),
+    ('a' * 64, False),
+    ('', False),
+])
+def test_is_stored_name(name, stored):
+    assert is_stored_name(name) is stored
+
+
+def test_follow_file_reads_a_file_while_it_grows(tmp_path):
+    path = str(tmp_path / 'live.mp4')
+    finished = threading.Event()
+
+    def writer():
+        with open(path, 'wb') as f:
+            for i in range(5):
+                f.write(bytes([i]) * 1000)
+                f.flush()
+                time.sleep(0.02)
+        finished.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    data = b''.join(follow_file(path, finished.is_set, poll=0.01))
+    thread.join()
+
+    assert data == b''.join(bytes([i]) * 1000 for i in range(5))
+
+
+def test_follow_file_keeps_reading_after_the_file_is_moved(tmp_path):
+    path, moved = str(tmp_path / 'live.mp4'), str(tmp_path / 'done.mp4')
+    with open(path, 'wb') as f:
+        f.write(b'first')
+    finished = threading.Event()
+    chunks = follow_file(path, finished.is_set, poll=0.01)
+
+    assert next(chunks) == b'first'
+    os.replace(path, moved)
+    with open(moved, 'ab') as f:
+        f.write(b'second')
+    finished.set()
+
+    assert b''.join(chunks) == b'second'
+
+
+def test_follow_file_yields_nothing_for_a_file_that_never_appears(tmp_path):
+    assert list(follow_file(str(tmp_path / 'missing.mp4'), lambda: True)) == []
+
+
+def test_read_range_streams_the_range_and_closes_the_file(tmp_path):
+    path = tmp_path / 'output.mp4'
+    path.write_bytes(DATA)
+    f = open(path, 'rb')
+
+    assert b''.join(read_range(f, 100, 2000)) == DATA[100:2000]
+    assert f.closed
+
+
+def test_read_range_stops_at_the_current_end(tmp_path):
+    path = tmp_path / 'output.mp4'
+    path.write_bytes(DATA[:500])
+    f = open(path, 'rb')
+
+    assert b''.join(read_range(f, 400, 10000)) == DATA[400:500]
+    assert f.closed
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.video import INPAINT_RADIUS, RoiInpainter, clamp_roi, inpaint_flags
+
+
+def make_frame(width=160, height=90, seed=0):
+    rng = np.random.default_rng(seed)
+    # Smooth gradients plus noise, so inpainting has real structure to fill from
+    ys, xs = np.mgrid[0:height, 0:width]
+    base = np.stack([xs * 255 // width, ys * 255 // height, (xs + ys) * 255 // (width + height)], axis=-1)
+    noise = rng.integers(0, 40, size=(height, width, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def full_frame_inpaint(frame, roi, inpaint_method):
+    x, y, w, h = clamp_roi(roi, frame.shape[1], frame.shape[0])
+    mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+    mask[y:y + h, x:x + w] = 255
+    return cv2.inpaint(frame, mask, INPAINT_RADIUS, inpaint_flags(inpaint_method))
+
+
+@pytest.mark.parametrize('inpaint_method', ['telea', 'ns'])
+@pytest.mark.parametrize('roi', [
+    (60, 30, 40, 20),    # inside the frame
+    (0, 0, 30, 15),      # touching the top-left corner
+    (140, 70, 40, 40),   # running past the bottom-right edge
+])
+def test_crop_matches_full_frame_inpaint(inpaint_method, roi):
+    frame = make_frame()
+    expected = full_frame_inpaint(frame, roi, inpaint_method)
+
+    result = RoiInpainter((frame.shape[1], frame.shape[0]), roi, inpaint_method).apply(frame.copy())
+
+    assert np.array_equal(result, expected)
+
+
+def test_apply_works_in_place_and_keeps_pixels_outside_roi():
+    frame = make_frame()
+    original = frame.copy()
+    inpainter = RoiInpainter((frame.shape[1], frame.shape[0]), (60, 30, 40, 20))
+
+    result = inpainter.apply(frame)
+
+    assert result is frame
+    outside = np.ones(frame.shape[:2], dtype=bool)
+    outside[30:50, 60:100] = False
+    assert np.array_equal(frame[outside], original[outside])
+
+
+def test_reuse_on_unchanged_frames_gives_the_same_output():
+    frame = make_frame()
+    roi = (60, 30, 40, 20)
+    expected = full_frame_inpaint(frame, roi, 'telea')
+    inpainter = RoiInpainter((frame.shape[1], frame.shape[0]), roi, reuse_tolerance=0)
+
+    results = [inpainter.apply(frame.copy()) for _ in range(3)]
+
+    assert (inpainter.hits, inpainter.misses) == (2, 1)
+    for result in results:
+        assert np.array_equal(result, expected)
+
+
+def test_reuse_keeps_band_changes_within_tolerance():
+    frame = make_frame()
+    roi = (60, 30, 40, 20)
+    inpainter = RoiInpainter((frame.shape[1], frame.shape[0]), roi, reuse_tolerance=5)
+    inpainter.apply(frame.copy())
+
+    changed = frame.copy()
+    # Just outside the ROI, inside the padded crop
+    changed[29, 70] = np.clip(changed[29, 70].astype(int) + 3, 0, 255)
+    result = inpainter.apply(changed.copy())
+
+    assert inpainter.hits == 1
+    assert np.array_equal(result[29, 70], changed[29, 70])
+
+
+def test_reuse_recomputes_past_tolerance_and_on_refresh():
+    frame = make_frame()
+    roi = (60, 30, 40, 20)
+    inpainter = RoiInpainter((frame.shape[1], frame.shape[0]), roi, reuse_tolerance=5, refresh_interval=3)
+
+    inpainter.apply(frame.copy())
+    changed = frame.copy()
+    changed[29, 70] = (changed[29, 70].astype(int) + 128) % 256
+    inpainter.apply(changed.copy())
+    assert (inpainter.hits, inpainter.misses) == (0, 2)
+
+    for _ in range(3):
+        inpainter.apply(changed.copy())
+    # Two reuses, then refresh_interval forces the third frame to be recomputed
+    assert (inpainter.hits, inpainter.misses) == (2, 3)
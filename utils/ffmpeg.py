@@ -0,0 +1,310 @@
+import os
+import json
+import subprocess
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+
+# Quality map: include ultra (lossless x264)
+QUALITY_PRESETS = {
+    'fast': ('veryfast', '23', None),
+    'balanced': ('medium', '20', None),
+    'better': ('slow', '18', None),
+    'best': ('veryslow', '16', None),
+    'ultra': ('placebo', None, '0')  # qp=0 lossless
+}
+
+
+BT709_TAGS = ['-color_primaries', 'bt709', '-color_trc', 'bt709', '-colorspace', 'bt709']
+
+# Fragmented MP4 can be read while it is still being written and needs no
+# faststart pass, which rewrites the whole file once encoding has finished.
+# Fragments start at keyframes or every 2s, whichever comes first.
+FRAGMENTED_MOVFLAGS = ['-movflags', '+frag_keyframe+empty_moov+default_base_moof', '-frag_duration', '2000000']
+FASTSTART_MOVFLAGS = ['-movflags', '+faststart']
+
+
+def mp4_movflags(fragmented: bool) -> List[str]:
+    return FRAGMENTED_MOVFLAGS if fragmented else FASTSTART_MOVFLAGS
+
+
+# Bumped whenever probe_media changes what its fields mean, so saved records get re-probed.
+# 2: width and height are the decoded (rotated) frame size.
+MEDIA_RECORD_VERSION = 2
+
+# Display rotation, from the display matrix side data or the older rotate tag
+ROTATION_ENTRIES = 'stream_side_data=rotation:stream_tags=rotate'
+
+
+def probe_video(path: str) -> Tuple[int, int, float]:
+    """Return (width, height, fps) of the first video stream as decoded, i.e. after rotation (see display_size)."""
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', f'stream=width,height,avg_frame_rate,r_frame_rate:{ROTATION_ENTRIES}', '-of', 'json', path
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {proc.stderr[:800]}")
+    stream = json.loads(proc.stdout)['streams'][0]
+    fps = parse_frame_rate(stream.get('avg_frame_rate')) or parse_frame_rate(stream.get('r_frame_rate')) or 25.0
+    return (*display_size(stream), fps)
+
+
+def stream_rotation(stream: dict) -> int:
+    """Display rotation of an ffprobe stream entry in degrees, 0 to 359."""
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(round(float(side_data['rotation']))) % 360
+    try:
+        return int(stream.get('tags', {}).get('rotate', 0)) % 360
+    except ValueError:
+        return 0
+
+
+def display_size(stream: dict) -> Tuple[int, int]:
+    """(width, height) of the frames ffmpeg and OpenCV decode from a stream entry.
+
+    Both rotate frames for display by default, so a 1920x1080 phone clip tagged
+    with a 90 degree rotation decodes to 1080x1920 frames.
+    """
+    width, height = int(stream['width']), int(stream['height'])
+    return (height, width) if stream_rotation(stream) % 180 == 90 else (width, height)
+
+
+def parse_frame_rate(value: Optional[str]) -> float:
+    """Parse an ffprobe rate such as '30000/1001'; returns 0.0 when unknown."""
+    try:
+        num, _, den = (value or '').partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def build_scale_filter(src_w: int, src_h: int) -> str:
+    if src_h >= 2160:
+        return 'scale=iw:ih:flags=lanczos'
+    if src_h >= 1080:
+        return 'scale=iw:ih:flags=lanczos'
+    target_h = 1080
+    target_w = int(round(src_w * (target_h / src_h)))
+    if target_w % 2 == 1:
+        target_w += 1
+    return f'scale={target_w}:{target_h}:flags=lanczos'
+
+
+def build_encode_command(video_input: List[str], source_with_audio: Optional[str], output_path: str, quality: str, scale_filter: str,
+                         faststart: bool = True, colors: Optional[List[str]] = None, fragmented: bool = False) -> List[str]:
+    """Build the x264 + AAC encode command for a video input given as ffmpeg input args.
+
+    With source_with_audio=None the output is video only. colors replaces the
+    default BT.709 tags (see color_args). fragmented writes fragmented MP4
+    instead of moving the index to the front with faststart.
+    """
+    preset, crf, qp = QUALITY_PRESETS.get(quality, ('placebo', None, '0'))
+    rate_control = ['-qp', qp] if qp is not None else ['-crf', crf]
+    audio_input = ['-i', source_with_audio, '-map', '0:v:0', '-map', '1:a:0?'] if source_with_audio else ['-map', '0:v:0']
+    audio_codec = ['-c:a', 'aac', '-b:a', '192k'] if source_with_audio else []
+
+    return [
+        'ffmpeg', '-y',
+        *video_input,
+        *audio_input,
+        '-filter:v', scale_filter,
+        '-c:v', 'libx264', '-preset', preset, *rate_control,
+        '-pix_fmt', 'yuv420p',
+        *(colors if colors is not None else BT709_TAGS),
+        *(mp4_movflags(fragmented) if faststart or fragmented else []),
+        *audio_codec,
+        output_path
+    ]
+
+
+def encode_frames_and_mux(frames_dir: str, fps: float, source_with_audio: str, output_path: str, quality: str, scale_filter: str,
+                          cancel_event=None, fragmented: bool = False) -> None:
+    pattern = os.path.join(frames_dir, 'frame_%06d.png')
+    cmd = build_encode_command(['-framerate', str(fps), '-i', pattern], source_with_audio, output_path, quality, scale_filter,
+                               fragmented=fragmented)
+    run_ffmpeg(cmd, cancel_event)
+
+
+def raw_video_input(width: int, height: int, fps: float) -> List[str]:
+    """Input args for RGB24 frames written to the encoder's stdin.
+
+    RGB rather than BGR so swscale takes the same conversion path as PNG input.
+    """
+    return ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-framerate', str(fps), '-i', 'pipe:0']
+
+
+def build_decode_command(path: str, seek: Optional[float] = None, frames: Optional[int] = None) -> List[str]:
+    """Decode the first video stream to RGB24 frames on stdout.
+
+    seek should be a keyframe time (see probe_gops): decoding then starts exactly
+    at that keyframe. It is nudged forward by 1ms so rounding in the printed
+    timestamp cannot land on the previous keyframe. frames stops after that many
+    frames.
+    """
+    seek_args = ['-noaccurate_seek', '-ss', f'{seek + 0.001:.6f}'] if seek else []
+    frame_args = ['-frames:v', str(frames)] if frames is not None else []
+    return ['ffmpeg', '-v', 'error', '-nostdin', *seek_args, '-i', path, '-map', '0:v:0', *frame_args,
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1']
+
+
+def probe_packets(path: str) -> Tuple[float, Optional[List[Tuple[float, bool]]]]:
+    """Return the container start time and (pts, is_keyframe) for each packet of the first video stream.
+
+    The packet list is None when some packets have no pts (the AVI demuxer
+    leaves it unset for streams with B-frames): the file cannot then be split at
+    keyframes, but can still be processed in one piece.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags:format=start_time', '-of', 'json', path
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {proc.stderr[:800]}")
+    info = json.loads(proc.stdout)
+    try:
+        start_time = float(info.get('format', {}).get('start_time', 0.0))
+    except ValueError:
+        start_time = 0.0
+
+    return start_time, _parse_packets(info.get('packets', []))
+
+
+def _parse_packets(entries: List[dict]) -> Optional[List[Tuple[float, bool]]]:
+    if not entries:
+        raise RuntimeError('No video packets found')
+    packets = []
+    for pkt in entries:
+        try:
+            packets.append((float(pkt['pts_time']), 'K' in pkt.get('flags', '')))
+        except (KeyError, ValueError):
+            return None
+    return packets
+
+
+def split_gops(start_time: float, packets: List[Tuple[float, bool]]) -> List[Tuple[float, int]]:
+    """Group probe_packets output into (start, frame_count) per GOP; see probe_gops."""
+    keyframes = sorted(pts for pts, key in packets if key) or [min(pts for pts, _ in packets)]
+    counts = [0] * len(keyframes)
+    for pts, _ in packets:
+        counts[max(0, bisect_right(keyframes, pts) - 1)] += 1
+
+    gops = [(max(0.0, pts - start_time), count) for pts, count in zip(keyframes, counts)]
+    gops[0] = (0.0, gops[0][1])
+    return gops
+
+
+def probe_gops(path: str) -> List[Tuple[float, int]]:
+    """Return (start, frame_count) for each GOP of the first video stream.
+
+    start is the keyframe time relative to the container start, i.e. the value
+    ffmpeg's -ss expects; frame_count counts frames in presentation order. Frames
+    that precede the first keyframe are folded into the first GOP. Empty when
+    the packets have no timestamps (see probe_packets).
+    """
+    start_time, packets = probe_packets(path)
+    return split_gops(start_time, packets) if packets else []
+
+
+STREAM_KEYS = ('codec_name', 'pix_fmt', 'color_space', 'color_primaries', 'color_transfer')
+
+
+def probe_stream(path: str) -> dict:
+    """Return codec_name, pix_fmt, the color_* tags and rotation of the first video stream.
+
+    Absent tags are omitted, as is rotation when the stream is not rotated.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', f'stream={",".join(STREAM_KEYS)}:{ROTATION_ENTRIES}', '-of', 'json', path
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {proc.stderr[:800]}")
+    return _stream_info(json.loads(proc.stdout)['streams'][0])
+
+
+def _stream_info(stream: dict) -> dict:
+    info = {key: stream[key] for key in STREAM_KEYS if stream.get(key) not in (None, '', 'unknown')}
+    rotation = stream_rotation(stream)
+    if rotation:
+        info['rotation'] = rotation
+    return info
+
+
+def probe_media(path: str) -> dict:
+    """Everything the pipelines need to know about a file, from a single ffprobe run.
+
+    Returns a JSON-serialisable dict with version (MEDIA_RECORD_VERSION),
+    width, height (as decoded, see display_size), fps, duration, start_time,
+    frame_count, has_audio, stream (as probe_stream), packets (as probe_packets,
+    for the first video stream) and gops (as probe_gops). Reading the packets
+    means demuxing the whole file once. packets and gops are None when the
+    packets have no timestamps; the pipelines then process the file in one piece.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', f'stream=index,codec_type,{",".join(STREAM_KEYS)},width,height,avg_frame_rate,r_frame_rate:{ROTATION_ENTRIES}'
+                         ':format=start_time,duration:packet=stream_index,pts_time,flags',
+        '-of', 'json', path
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {proc.stderr[:800]}")
+    info = json.loads(proc.stdout)
+    streams = info.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if video is None:
+        raise RuntimeError('No video stream found')
+    fmt = info.get('format', {})
+    try:
+        start_time = float(fmt.get('start_time', 0.0))
+    except ValueError:
+        start_time = 0.0
+    try:
+        duration = float(fmt.get('duration', 0.0))
+    except ValueError:
+        duration = 0.0
+
+    entries = [pkt for pkt in info.get('packets', []) if pkt.get('stream_index') == video['index']]
+    packets = _parse_packets(entries)
+    width, height = display_size(video)
+    return {
+        'version': MEDIA_RECORD_VERSION,
+        'width': width,
+        'height': height,
+        'fps': parse_frame_rate(video.get('avg_frame_rate')) or parse_frame_rate(video.get('r_frame_rate')) or 25.0,
+        'duration': duration,
+        'start_time': start_time,
+        'frame_count': len(entries),
+        'has_audio': any(s.get('codec_type') == 'audio' for s in streams),
+        'stream': _stream_info(video),
+        'packets': packets,
+        'gops': split_gops(start_time, packets) if packets else None,
+    }
+
+
+def color_args(stream: dict) -> List[str]:
+    """Encoder args that tag the output with the same colour properties as a probe_stream result."""
+    options = (('color_primaries', '-color_primaries'), ('color_transfer', '-color_trc'), ('color_space', '-colorspace'))
+    return [arg for key, flag in options if key in stream for arg in (flag, stream[key])]
+
+
+def run_ffmpeg(cmd: list, cancel_event=None) -> None:
+    """Run ffmpeg to completion; kill it and raise if cancel_event gets set."""
+    env = os.environ.copy()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, text=True)
+    while True:
+        try:
+            _, stderr = proc.communicate(timeout=None if cancel_event is None else 0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel_event.is_set():
+                proc.kill()
+                proc.communicate()
+                raise RuntimeError('Processing cancelled')
+    if proc.returncode != 0:
+        # The error is at the end; the start is just the banner
+        raise RuntimeError(f"ffmpeg failed: {stderr[-800:]}")
@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from utils.metrics import ResourceSampler
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class Job:
+    """A unit of background work with per-stage frame progress and cancellation.
+
+    target(job) does the work; it should report frames through job.progress and
+    pass job.cancel_event down to anything that can be interrupted. Its return
+    value is stored as job.result. Progress names listed in stage_names count
+    towards completion and the ETA; any other name is reported as a plain counter.
+
+    job.timing(stage, seconds) adds up where the time went. While running, peak
+    RSS and the peak size of temp_dir (which should be private to the job) are
+    sampled. labels (pipeline, method, ...) are passed through to the metrics.
+    live_output names the file target writes while running, if it can be read
+    before the job is done.
+    """
+
+    def __init__(self, target: Callable[['Job'], dict], cpus: int = 1, total_frames: int = 0, stage_names: Sequence[str] = (),
+                 temp_dir: Optional[str] = None, labels: Optional[Dict[str, str]] = None,
+                 live_output: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.state = 'queued'
+        self.cpus = max(1, cpus)
+        self.total_frames = total_frames
+        self.stage_names = tuple(stage_names)
+        self.stages: Dict[str, int] = {}
+        self.timings: Dict[str, float] = {}
+        self.temp_dir = temp_dir
+        self.labels = dict(labels or {})
+        self.live_output = live_output
+        self.peak_rss = 0
+        self.peak_temp_bytes = 0
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self._target = target
+        self._lock = threading.Lock()
+
+    def progress(self, stage: str, frames: int = 1) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0) + frames
+
+    def timing(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def run(self) -> None:
+        self.state = 'running'
+        self.started_at = time.time()
+        sampler = ResourceSampler(self.temp_dir).start()
+        try:
+            self.result = self._target(self)
+            self.state = 'done'
+        except Exception as exc:
+            if self.cancel_event.is_set():
+                self.state = 'cancelled'
+            else:
+                self.state = 'failed'
+                self.error = str(exc)
+        finally:
+            sampler.stop()
+            self.peak_rss = sampler.peak_rss
+            self.peak_temp_bytes = sampler.peak_temp_bytes
+            self.finished_at = time.time()
+
+    def eta(self) -> Optional[float]:
+        """Seconds left, extrapolated from the slowest stage's rate so far."""
+        with self._lock:
+            stages = dict(self.stages)
+        return self._eta(stages)
+
+    def _eta(self, stages: Dict[str, int]) -> Optional[float]:
+        # A stage that has not reported yet counts as 0 done, so there is no
+        # estimate until every stage has started (frames only encodes at the end)
+        names = self.stage_names or tuple(stages)
+        if self.state != 'running' or not self.total_frames or not names:
+            return None
+        done = min(stages.get(name, 0) for name in names)
+        elapsed = time.time() - self.started_at
+        if done <= 0 or elapsed <= 0:
+            return None
+        return max(0.0, elapsed * (self.total_frames - done) / done)
+
+    def fps(self) -> Optional[float]:
+        """Encoded frames per second of wall-clock time since the job started."""
+        if self.started_at is None:
+            return None
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        encoded = self.stages.get('encode', 0)
+        return encoded / elapsed if elapsed > 0 and encoded else None
+
+    def to_dict(self) -> dict:
+        stages, counters = {}, {}
+        with self._lock:
+            snapshot = dict(self.stages)
+            for name, frames in snapshot.items():
+                if not self.stage_names or name in self.stage_names:
+                    stages[name] = {'frames': frames, 'total': self.total_frames}
+                else:
+                    counters[name] = frames
+            timings = dict(self.timings)
+        data = {
+            'jobId': self.id,
+            'state': self.state,
+            'stages': stages,
+            'counters': counters,
+            'totalFrames': self.total_frames,
+            'eta': self._eta(snapshot),
+            'fps': self.fps(),
+            'timings': timings,
+            'peakRss': self.peak_rss,
+            'peakTempBytes': self.peak_temp_bytes,
+            'labels': self.labels,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+        if self.error:
+            data['error'] = self.error
+        if self.result:
+            data.update(self.result)
+        return data
+
+
+class JobQueue:
+    """In-process FIFO job queue run by a fixed pool of worker threads.
+
+    Admission control: a job only starts when its cpus fit in the remaining
+    cpu_budget (a job larger than the budget runs alone), so CPU-heavy jobs
+    cannot oversubscribe the machine. The head of the queue is never skipped,
+    which keeps large jobs from starving. Finished jobs are kept for status
+    queries up to keep_finished entries. on_finish(job) is called after every
+    job that ran, whatever its outcome.
+    """
+
+    def __init__(self, workers: int = 2, cpu_budget: Optional[int] = None, max_queued: int = 16, keep_finished: int = 200,
+                 on_finish: Optional[Callable[[Job], None]] = None):
+        self.workers = max(1, workers)
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.on_finish = on_finish
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._queued = deque()
+        self._cpus_in_use = 0
+        self._running = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, job: Job) -> Job:
+        with self._cond:
+            if len(self._queued) >= self.max_queued:
+                raise QueueFull('Too many jobs queued, try again later')
+            self._start_workers()
+            self._jobs[job.id] = job
+            self._queued.append(job)
+            self._prune()
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> Optional[int]:
+        """0-based place in the queue, or None once the job has started."""
+        with self._cond:
+            try:
+                return self._queued.index(job)
+            except ValueError:
+                return None
+
+    def counts(self) -> Tuple[int, int]:
+        """(queued, running) job counts."""
+        with self._cond:
+            return len(self._queued), self._running
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.cancel()
+            if job in self._queued:
+                self._queued.remove(job)
+                job.state = 'cancelled'
+                job.finished_at = time.time()
+                self._cond.notify_all()
+        return job
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _admissible(self) -> bool:
+        if not self._queued:
+            return False
+        if self._running == 0:
+            return True
+        return self._cpus_in_use + self._queued[0].cpus <= self.cpu_budget
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._admissible():
+                    self._cond.wait()
+                job = self._queued.popleft()
+                self._cpus_in_use += job.cpus
+                self._running += 1
+            try:
+                job.run()
+                if self.on_finish is not None:
+                    try:
+                        self.on_finish(job)
+                    except Exception:
+                        pass
+            finally:
+                with self._cond:
+                    self._cpus_in_use -= job.cpus
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
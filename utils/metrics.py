@@ -0,0 +1,189 @@
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def _status_rss(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        pass
+    return children
+
+
+def process_tree_rss(pid: Optional[int] = None) -> int:
+    """Resident bytes of a process and all its descendants (ffmpeg, pool workers).
+
+    Reads /proc; elsewhere falls back to this process's own peak RSS (0 on Windows).
+    """
+    pid = pid or os.getpid()
+    if not os.path.exists(f'/proc/{pid}/status'):
+        try:
+            import resource
+        except ImportError:
+            return 0
+        # ru_maxrss is in bytes on macOS and in KiB elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += _status_rss(current)
+        pending.extend(_children(current))
+    return total
+
+
+def directory_size(path: Optional[str]) -> int:
+    """Total bytes of the files under path; 0 when it does not exist."""
+    if not path:
+        return 0
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += directory_size(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        return 0
+    return total
+
+
+class ResourceSampler:
+    """Background thread tracking peak process-tree RSS and peak size of temp_dir.
+
+    RSS covers the whole server process, so jobs running side by side see each
+    other's memory; temp_dir should be private to the job. RSS is read every
+    interval seconds, temp_dir is walked only every temp_interval seconds since
+    a job can hold thousands of frame files there.
+    """
+
+    def __init__(self, temp_dir: Optional[str] = None, interval: float = 0.5, temp_interval: float = 5.0):
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.temp_interval = temp_interval
+        self._temp_sampled_at: Optional[float] = None
+        self.peak_rss = 0
+        self.peak_temp_bytes = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'ResourceSampler':
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample(force=True)
+
+    def _sample(self, force: bool = False) -> None:
+        self.peak_rss = max(self.peak_rss, process_tree_rss())
+        now = time.monotonic()
+        if force or self._temp_sampled_at is None or now - self._temp_sampled_at >= self.temp_interval:
+            self._temp_sampled_at = now
+            self.peak_temp_bytes = max(self.peak_temp_bytes, directory_size(self.temp_dir))
+
+    def _run(self) -> None:
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                return
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value: float) -> str:
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class JobMetrics:
+    """Totals over finished jobs, rendered in the Prometheus text format.
+
+    record() takes the job's final to_dict(); jobs are grouped by their labels
+    (pipeline, method, quality).
+    """
+
+    LABELS = ('pipeline', 'method', 'quality')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[tuple, int] = defaultdict(int)
+        self._seconds: Dict[tuple, float] = defaultdict(float)
+        self._frames: Dict[tuple, int] = defaultdict(int)
+        self._stage_seconds: Dict[tuple, float] = defaultdict(float)
+        self._peak_rss: Dict[tuple, int] = {}
+        self._peak_temp: Dict[tuple, int] = {}
+        self._last_fps: Dict[tuple, float] = {}
+
+    def record(self, job: dict) -> None:
+        labels = tuple((name, job.get('labels', {}).get(name, '')) for name in self.LABELS)
+        with self._lock:
+            self._jobs[labels + (('state', job['state']),)] += 1
+            if job['state'] != 'done':
+                return
+            if job.get('startedAt') and job.get('finishedAt'):
+                self._seconds[labels] += job['finishedAt'] - job['startedAt']
+            self._frames[labels] += job.get('stages', {}).get('encode', {}).get('frames', 0)
+            for stage, seconds in job.get('timings', {}).items():
+                self._stage_seconds[labels + (('stage', stage),)] += seconds
+            self._peak_rss[labels] = max(self._peak_rss.get(labels, 0), job.get('peakRss') or 0)
+            self._peak_temp[labels] = max(self._peak_temp.get(labels, 0), job.get('peakTempBytes') or 0)
+            if job.get('fps'):
+                self._last_fps[labels] = job['fps']
+
+    def render(self, gauges: Iterable[Tuple[str, str, float]] = ()) -> str:
+        """Prometheus exposition text; gauges adds (name, help, value) point-in-time values."""
+        families = [
+            ('watermark_jobs_total', 'counter', 'Finished jobs by final state.', self._jobs),
+            ('watermark_job_seconds_total', 'counter', 'Wall-clock seconds spent running successful jobs.', self._seconds),
+            ('watermark_frames_total', 'counter', 'Frames encoded by successful jobs.', self._frames),
+            ('watermark_stage_seconds_total', 'counter',
+             'Seconds spent in each stage, summed over worker processes.', self._stage_seconds),
+            ('watermark_job_peak_rss_bytes', 'gauge', 'Largest server plus child process RSS seen during a job.', self._peak_rss),
+            ('watermark_job_peak_temp_bytes', 'gauge', 'Largest temp disk usage of a single job.', self._peak_temp),
+            ('watermark_last_job_fps', 'gauge', 'Encoded frames per second of the latest successful job.', self._last_fps),
+        ]
+        lines = []
+        with self._lock:
+            for name, kind, help_text, values in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(values.items()):
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        for name, help_text, value in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
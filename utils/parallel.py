@@ -0,0 +1,189 @@
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from utils.ffmpeg import mp4_movflags, probe_gops, run_ffmpeg
+from utils.pipeline import COUNTERS, TIMERS, ProgressCallback, StreamingPipeline, TimingCallback, remove_watermark_roi_streaming
+
+
+# Aim for a few segments per worker so one slow segment does not idle the rest
+SEGMENTS_PER_WORKER = 4
+
+
+def plan_segments(gops: List[Tuple[float, int]], target_segments: int) -> List[Tuple[float, int]]:
+    """Merge consecutive GOPs into about target_segments (start, frame_count) runs of similar length."""
+    total = sum(count for _, count in gops)
+    per_segment = max(1, total // max(1, target_segments))
+    segments = []
+    start, frames = gops[0][0], 0
+    for gop_start, count in gops:
+        if frames >= per_segment:
+            segments.append((start, frames))
+            start, frames = gop_start, 0
+        frames += count
+    segments.append((start, frames))
+    return segments
+
+
+# Per-worker-process handles to the parent's shared progress counters, stage timers and cancel flag
+_worker_state = {}
+
+
+def _init_worker(counters, timers, cancel_event) -> None:
+    _worker_state['counters'] = counters
+    _worker_state['timers'] = timers
+    _worker_state['cancel_event'] = cancel_event
+
+
+def _count_frame(stage: str, frames: int) -> None:
+    counters = _worker_state['counters']
+    with counters.get_lock():
+        counters[COUNTERS.index(stage)] += frames
+
+
+def _add_time(stage: str, seconds: float) -> None:
+    timers = _worker_state['timers']
+    with timers.get_lock():
+        timers[TIMERS.index(stage)] += seconds
+
+
+def _process_segment(options: dict) -> int:
+    # Small queues: many workers run at once and each buffer is a full frame
+    pipeline = StreamingPipeline(**options, queue_size=2, mux_audio=False, progress=_count_frame,
+                                 cancel_event=_worker_state['cancel_event'], timing=_add_time)
+    return pipeline.run()
+
+
+def _relay(counters, worker_cancel, progress: Optional[ProgressCallback], cancel_event, done: threading.Event) -> None:
+    """Forward worker frame counts to progress and the caller's cancel_event to the workers."""
+    reported = [0] * len(COUNTERS)
+    while True:
+        finished = done.wait(0.25)
+        if cancel_event is not None and cancel_event.is_set():
+            worker_cancel.set()
+        if progress is not None:
+            with counters.get_lock():
+                current = list(counters)
+            for i, stage in enumerate(COUNTERS):
+                if current[i] > reported[i]:
+                    progress(stage, current[i] - reported[i])
+            reported = current
+        if finished:
+            return
+
+
+def run_segments(segments: List[dict], workers: int, progress: Optional[ProgressCallback] = None, cancel_event=None,
+                 timing: Optional[TimingCallback] = None) -> int:
+    """Run one video-only StreamingPipeline per entry of segments in a process pool.
+
+    Each entry holds StreamingPipeline keyword arguments (input_path, output_path,
+    roi, seek, frame_count, ...). Returns the total number of frames encoded.
+    Stage times are summed over all workers and reported to timing at the end.
+    """
+    # spawn rather than fork: pools are started from job threads of a threaded server
+    ctx = multiprocessing.get_context('spawn')
+    counters = ctx.Array('q', len(COUNTERS))
+    timers = ctx.Array('d', len(TIMERS))
+    worker_cancel = ctx.Event()
+    done = threading.Event()
+    relay = threading.Thread(target=_relay, args=(counters, worker_cancel, progress, cancel_event, done), daemon=True)
+    relay.start()
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(segments))), mp_context=ctx, initializer=_init_worker,
+                                 initargs=(counters, timers, worker_cancel)) as pool:
+            try:
+                return sum(pool.map(_process_segment, segments))
+            except BaseException:
+                # Stop the remaining segments instead of waiting for them
+                worker_cancel.set()
+                pool.shutdown(cancel_futures=True)
+                raise
+    finally:
+        done.set()
+        relay.join()
+        if timing is not None:
+            for stage, seconds in zip(TIMERS, timers):
+                if seconds:
+                    timing(stage, seconds)
+
+
+def write_concat_list(paths: List[str], list_path: str) -> str:
+    """Write an ffmpeg concat demuxer list of paths and return list_path."""
+    with open(list_path, 'w') as f:
+        for path in paths:
+            f.write(f"file '{path}'\n")
+    return list_path
+
+
+def remove_watermark_roi_parallel(input_video_path: str, output_path: str, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea',
+                                  quality: str = 'ultra', scale_filter: Optional[str] = None, workers: Optional[int] = None,
+                                  temp_dir: Optional[str] = None, progress: Optional[ProgressCallback] = None, cancel_event=None,
+                                  reuse_tolerance: Optional[int] = None, refresh_interval: int = 0,
+                                  timing: Optional[TimingCallback] = None, fragmented: bool = False,
+                                  media: Optional[dict] = None) -> int:
+    """Remove a watermark with one process per keyframe-aligned segment.
+
+    Each worker decodes, inpaints and encodes its own segment to a video-only
+    file. The segments are then joined with the concat demuxer (stream copy) and
+    the source audio is muxed back in. Falls back to the single-process stream
+    pipeline when the video has only one segment, no packet timestamps to split
+    it by, or workers is 1.
+
+    progress, cancel_event and the inpaint cache options behave as for
+    StreamingPipeline; worker progress is relayed from the pool every 250ms.
+    timing gets the stage times summed over the workers, plus the concat.
+    fragmented makes the joined output fragmented MP4 (see StreamingPipeline).
+    media is the probe_media record of the input, when there is one; the GOPs,
+    frame size and audio presence are then taken from it instead of probed.
+    Each segment starts with an empty inpaint cache.
+
+    Returns:
+        frames (int): number of frames encoded.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers > 1:
+        gops = media['gops'] if media else probe_gops(input_video_path)
+    else:
+        gops = []
+    video_info = (media['width'], media['height'], media['fps']) if media else None
+    has_audio = media['has_audio'] if media else True
+    segments = plan_segments(gops, workers * SEGMENTS_PER_WORKER) if gops else []
+    if len(segments) < 2:
+        return remove_watermark_roi_streaming(input_video_path, output_path, roi, inpaint_method, quality, scale_filter, decoder='ffmpeg',
+                                              progress=progress, cancel_event=cancel_event,
+                                              reuse_tolerance=reuse_tolerance, refresh_interval=refresh_interval, timing=timing,
+                                              fragmented=fragmented, video_info=video_info)
+
+    work_dir = os.path.join(temp_dir or os.path.dirname(os.path.abspath(output_path)), f"segments_{uuid.uuid4().hex}")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        segment_paths = [os.path.join(work_dir, f"segment_{i:05d}.mp4") for i in range(len(segments))]
+        options = [
+            dict(input_path=input_video_path, output_path=path, roi=roi, inpaint_method=inpaint_method, quality=quality,
+                 scale_filter=scale_filter or 'null', seek=seek, frame_count=frame_count,
+                 reuse_tolerance=reuse_tolerance, refresh_interval=refresh_interval, video_info=video_info)
+            for path, (seek, frame_count) in zip(segment_paths, segments)
+        ]
+        # map() inside run_segments yields in submission order, so segments stay in source order
+        frames = run_segments(options, workers, progress, cancel_event, timing)
+
+        started = time.perf_counter()
+        run_ffmpeg([
+            'ffmpeg', '-y',
+            '-f', 'concat', '-safe', '0', '-i', write_concat_list(segment_paths, os.path.join(work_dir, 'segments.txt')),
+            *(['-i', input_video_path, '-map', '0:v:0', '-map', '1:a:0?'] if has_audio else ['-map', '0:v:0']),
+            '-c:v', 'copy',
+            *mp4_movflags(fragmented),
+            *(['-c:a', 'aac', '-b:a', '192k'] if has_audio else []),
+            output_path
+        ], cancel_event)
+        if timing is not None:
+            timing('concat', time.perf_counter() - started)
+        return frames
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,332 @@
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from utils.ffmpeg import build_decode_command, build_encode_command, probe_video, raw_video_input
+from utils.video import RoiInpainter
+
+
+_DONE = object()
+
+DECODERS = ('opencv', 'ffmpeg')
+
+# Stage names reported to progress callbacks, in pipeline order
+STAGES = ('decode', 'inpaint', 'encode')
+# Every name progress callbacks may see: the stages plus frames served from the inpaint cache
+COUNTERS = STAGES + ('reused',)
+
+ProgressCallback = Callable[[str, int], None]
+
+# Names timing callbacks may see: the stages plus PNG writes, stream copies and concat
+TIMERS = STAGES + ('write', 'copy', 'concat')
+
+TimingCallback = Callable[[str, float], None]
+
+
+class StreamingPipeline:
+    """Decode -> inpaint -> encode with raw frames piped into ffmpeg, no frames on disk.
+
+    Each stage runs in its own thread and hands frames on through bounded queues.
+    Frames come from a fixed pool of buffers that cycles between the stages, so
+    memory stays constant no matter how long the video is. cv2.inpaint and the
+    pipe writes release the GIL, which lets the three stages overlap.
+
+    Frames are handed to the encoder as RGB. Inpainting treats channels
+    independently, so the ffmpeg decoder emits RGB directly and OpenCV frames
+    are swapped in place after inpainting.
+
+    seek and frame_count restrict the run to one keyframe-aligned segment (this
+    forces the ffmpeg decoder); with mux_audio=False the output is video only.
+    active_frames, when given, lists half-open (first, last) frame index ranges,
+    counted from the first decoded frame, that get inpainted; every other frame
+    is passed through untouched. colors overrides the encoder's colour tags
+    (see build_encode_command). With fragmented=True the output is fragmented
+    MP4, which can be served while it is still being written. video_info gives
+    (width, height, fps) of the input when it is already known, e.g. from
+    probe_media, and saves either decoder from probing the file.
+
+    progress is called as progress(stage, frames) each time a stage finishes a
+    frame, and as progress('reused', 1) when the inpaint cache was hit (see
+    RoiInpainter for reuse_tolerance and refresh_interval). timing is called
+    once per stage when the run ends as timing(stage, seconds), the time the
+    stage spent in its own work: reading from the decoder, inpainting, and
+    writing to the encoder pipe (which includes waiting for x264) plus the final
+    flush. Setting cancel_event (or calling cancel()) stops the run and kills ffmpeg.
+    """
+
+    def __init__(self, input_path: str, output_path: str, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea',
+                 quality: str = 'ultra', scale_filter: Optional[str] = None, decoder: str = 'opencv', queue_size: int = 8,
+                 seek: Optional[float] = None, frame_count: Optional[int] = None, mux_audio: bool = True,
+                 progress: Optional[ProgressCallback] = None, cancel_event=None,
+                 reuse_tolerance: Optional[int] = None, refresh_interval: int = 0,
+                 active_frames: Optional[Sequence[Tuple[int, int]]] = None, colors: Optional[List[str]] = None,
+                 timing: Optional[TimingCallback] = None, fragmented: bool = False,
+                 video_info: Optional[Tuple[int, int, float]] = None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.roi = roi
+        self.inpaint_method = inpaint_method
+        self.quality = quality
+        self.scale_filter = scale_filter
+        self.seek = seek
+        self.frame_count = frame_count
+        self.mux_audio = mux_audio
+        self.decoder = 'ffmpeg' if seek is not None or frame_count is not None else decoder
+        self.queue_size = max(1, queue_size)
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.reuse_tolerance = reuse_tolerance
+        self.refresh_interval = refresh_interval
+        self.active_frames: Optional[List[Tuple[int, int]]] = sorted(active_frames) if active_frames is not None else None
+        self.colors = colors
+        self.timing = timing
+        self.fragmented = fragmented
+        self.video_info = video_info
+        self.inpainter: Optional[RoiInpainter] = None
+
+        self.frames_decoded = 0
+        self.frames_inpainted = 0
+        self.frames_encoded = 0
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+        self._errors = []
+        self._procs = []
+
+    def run(self) -> int:
+        """Run the pipeline to completion and return the number of frames encoded."""
+        open_source = self._open_ffmpeg_source if self.decoder == 'ffmpeg' else self._open_opencv_source
+        width, height, fps, read_frame, close_source = open_source()
+        swap_channels = self.decoder != 'ffmpeg'
+
+        # Enough buffers to fill both queues plus one in flight per stage
+        free = queue.Queue()
+        for _ in range(2 * self.queue_size + 3):
+            free.put(np.empty((height, width, 3), dtype=np.uint8))
+        decoded = queue.Queue(maxsize=self.queue_size)
+        inpainted = queue.Queue(maxsize=self.queue_size)
+
+        scale_filter = self.scale_filter or 'null'
+        cmd = build_encode_command(raw_video_input(width, height, fps), self.input_path if self.mux_audio else None,
+                                   self.output_path, self.quality, scale_filter, faststart=self.mux_audio, colors=self.colors,
+                                   fragmented=self.fragmented)
+        stderr = tempfile.TemporaryFile()
+        encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+        self._procs.append(encoder)
+
+        inpainter = self.inpainter = RoiInpainter((width, height), self.roi, self.inpaint_method,
+                                                  reuse_tolerance=self.reuse_tolerance, refresh_interval=self.refresh_interval)
+        threads = [
+            threading.Thread(target=self._guard, args=(self._decode, read_frame, free, decoded), daemon=True),
+            threading.Thread(target=self._guard, args=(self._inpaint, inpainter, swap_channels, decoded, inpainted), daemon=True),
+        ]
+        if self.cancel_event is not None:
+            threads.append(threading.Thread(target=self._watch_cancel, daemon=True))
+        for t in threads:
+            t.start()
+
+        try:
+            self._guard(self._encode, encoder.stdin, inpainted, free)
+        finally:
+            self._finished.set()
+            for t in threads:
+                t.join()
+            close_source()
+            try:
+                encoder.stdin.close()
+            except OSError:
+                pass
+            if self._errors:
+                encoder.kill()
+            started = time.perf_counter()
+            encoder.wait()
+            self.stage_seconds['encode'] += time.perf_counter() - started
+            if self.timing is not None:
+                for stage, seconds in self.stage_seconds.items():
+                    self.timing(stage, seconds)
+            stderr.seek(0)
+            log = stderr.read().decode('utf-8', 'replace')
+            stderr.close()
+
+        if self._errors:
+            raise self._errors[0]
+        if encoder.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {log[-800:]}")
+        if self.frames_encoded == 0:
+            raise RuntimeError('No frames decoded from input video')
+        if self.frame_count is not None and self.frames_encoded != self.frame_count:
+            raise RuntimeError(f'Expected {self.frame_count} frames from segment at {self.seek}s, got {self.frames_encoded}')
+        return self.frames_encoded
+
+    def cancel(self) -> None:
+        """Stop all stages and kill any running ffmpeg process."""
+        self._fail(RuntimeError('Processing cancelled'))
+
+    def _fail(self, exc: BaseException) -> None:
+        if not self._stop.is_set():
+            self._errors.append(exc)
+        self._stop.set()
+        for proc in self._procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    def _watch_cancel(self) -> None:
+        while not self._finished.wait(0.2):
+            if self.cancel_event.is_set():
+                self.cancel()
+                return
+
+    def _advance(self, stage: str) -> None:
+        if self.progress is not None:
+            self.progress(stage, 1)
+
+    def _guard(self, stage, *args) -> None:
+        try:
+            stage(*args)
+        except Exception as exc:
+            self._fail(exc)
+
+    def _decode(self, read_frame, free: queue.Queue, decoded: queue.Queue) -> None:
+        while True:
+            buf = self._get(free)
+            if buf is None:
+                return
+            started = time.perf_counter()
+            frame = read_frame(buf)
+            self.stage_seconds['decode'] += time.perf_counter() - started
+            if frame is None:
+                self._put(decoded, _DONE)
+                return
+            self.frames_decoded += 1
+            self._advance('decode')
+            self._put(decoded, frame)
+
+    def _is_active(self, index: int) -> bool:
+        if self.active_frames is None:
+            return True
+        return any(first <= index < last for first, last in self.active_frames)
+
+    def _inpaint(self, inpainter: RoiInpainter, swap_channels: bool, decoded: queue.Queue, inpainted: queue.Queue) -> None:
+        index = 0
+        while True:
+            frame = self._get(decoded)
+            if frame is None or frame is _DONE:
+                self._put(inpainted, _DONE)
+                return
+            started = time.perf_counter()
+            reused = False
+            if self._is_active(index):
+                hits = inpainter.hits
+                inpainter.apply(frame)
+                reused = inpainter.hits > hits
+            index += 1
+            if swap_channels:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+            self.stage_seconds['inpaint'] += time.perf_counter() - started
+            if reused:
+                self._advance('reused')
+            self.frames_inpainted += 1
+            self._advance('inpaint')
+            self._put(inpainted, frame)
+
+    def _encode(self, stdin, inpainted: queue.Queue, free: queue.Queue) -> None:
+        while True:
+            frame = self._get(inpainted)
+            if frame is None or frame is _DONE:
+                return
+            started = time.perf_counter()
+            try:
+                stdin.write(memoryview(frame).cast('B'))
+            except (BrokenPipeError, OSError):
+                # ffmpeg exited; run() reports its stderr
+                self._stop.set()
+                return
+            self.stage_seconds['encode'] += time.perf_counter() - started
+            self.frames_encoded += 1
+            self._advance('encode')
+            # Hand the buffer back to the decoder
+            self._put(free, frame)
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _open_opencv_source(self):
+        cap = cv2.VideoCapture(self.input_path)
+        if not cap.isOpened():
+            raise RuntimeError('Failed to open input video')
+        if self.video_info is not None:
+            width, height, fps = self.video_info
+        else:
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+
+        def read_frame(buf):
+            ret, frame = cap.read(buf)
+            return frame if ret else None
+
+        return width, height, float(fps), read_frame, cap.release
+
+    def _open_ffmpeg_source(self):
+        width, height, fps = self.video_info or probe_video(self.input_path)
+        cmd = build_decode_command(self.input_path, self.seek, self.frame_count)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._procs.append(proc)
+        frame_bytes = width * height * 3
+
+        def read_frame(buf):
+            view = memoryview(buf).cast('B')
+            filled = 0
+            while filled < frame_bytes:
+                n = proc.stdout.readinto(view[filled:])
+                if not n:
+                    return None
+                filled += n
+            return buf
+
+        def close():
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+        return width, height, fps, read_frame, close
+
+
+def remove_watermark_roi_streaming(input_video_path: str, output_path: str, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea',
+                                   quality: str = 'ultra', scale_filter: Optional[str] = None, decoder: str = 'opencv',
+                                   progress: Optional[ProgressCallback] = None, cancel_event=None,
+                                   reuse_tolerance: Optional[int] = None, refresh_interval: int = 0,
+                                   active_frames: Optional[Sequence[Tuple[int, int]]] = None,
+                                   timing: Optional[TimingCallback] = None, fragmented: bool = False,
+                                   video_info: Optional[Tuple[int, int, float]] = None) -> int:
+    """Remove a watermark and encode straight to output_path without writing frames to disk.
+
+    Returns:
+        frames (int): number of frames encoded.
+    """
+    pipeline = StreamingPipeline(input_video_path, output_path, roi, inpaint_method, quality, scale_filter, decoder,
+                                 progress=progress, cancel_event=cancel_event,
+                                 reuse_tolerance=reuse_tolerance, refresh_interval=refresh_interval,
+                                 active_frames=active_frames, timing=timing, fragmented=fragmented, video_info=video_info)
+    return pipeline.run()
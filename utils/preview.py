@@ -0,0 +1,144 @@
+import base64
+import os
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.ffmpeg import build_encode_command, raw_video_input
+from utils.video import RoiInpainter, clamp_roi
+
+# Clips are previews only: keep them short and small
+CLIP_MAX_SECONDS = 3.0
+CLIP_HEIGHT = 360
+
+
+def read_frame(input_video_path: str, seconds: float) -> np.ndarray:
+    """Decode the BGR frame shown at seconds, seeking instead of decoding from the start."""
+    cap = cv2.VideoCapture(input_video_path)
+    if not cap.isOpened():
+        raise RuntimeError('Failed to open input video')
+    try:
+        cap.set(cv2.CAP_PROP_POS_MSEC, max(0.0, seconds) * 1000.0)
+        ret, frame = cap.read()
+    finally:
+        cap.release()
+    if not ret:
+        raise RuntimeError(f'No frame at {seconds:.3f}s')
+    return frame
+
+
+class FrameCache:
+    """LRU of decoded frames, at most frames_per_upload per file and uploads files.
+
+    Redrawing the ROI over the same frame then costs one inpaint of the crop
+    instead of a seek and decode. Frames are keyed by their timestamp in ms and
+    must not be modified by callers.
+    """
+
+    def __init__(self, frames_per_upload: int = 16, uploads: int = 8):
+        self.frames_per_upload = frames_per_upload
+        self.uploads = uploads
+        self._files: 'OrderedDict[str, OrderedDict[int, np.ndarray]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, input_video_path: str, seconds: float) -> np.ndarray:
+        key = int(round(seconds * 1000))
+        with self._lock:
+            frames = self._files.get(input_video_path)
+            if frames is not None and key in frames:
+                self._files.move_to_end(input_video_path)
+                frames.move_to_end(key)
+                return frames[key]
+
+        # Decode outside the lock so previews of other uploads are not held up
+        frame = read_frame(input_video_path, seconds)
+        with self._lock:
+            frames = self._files.setdefault(input_video_path, OrderedDict())
+            self._files.move_to_end(input_video_path)
+            frames[key] = frame
+            while len(frames) > self.frames_per_upload:
+                frames.popitem(last=False)
+            while len(self._files) > self.uploads:
+                self._files.popitem(last=False)
+        return frame
+
+    def discard(self, input_video_path: str) -> None:
+        with self._lock:
+            self._files.pop(input_video_path, None)
+
+
+def preview_frame(frame: np.ndarray, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea', max_width: Optional[int] = None) -> bytes:
+    """Inpaint roi on a copy of frame and return it as JPEG, downscaled to max_width if wider."""
+    height, width = frame.shape[:2]
+    # Only the padded crop around the ROI is inpainted, so copy the frame rather than decode again
+    result = RoiInpainter((width, height), roi, inpaint_method).apply(frame.copy())
+    if max_width and width > max_width:
+        result = cv2.resize(result, (max_width, int(round(height * max_width / width))), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', result, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError('Failed to encode preview frame')
+    return encoded.tobytes()
+
+
+def preview_clip(input_video_path: str, roi: Tuple[int, int, int, int], start: float, duration: float, inpaint_method: str = 'telea',
+                 temp_dir: Optional[str] = None, video_info: Optional[Tuple[int, int, float]] = None) -> bytes:
+    """Inpaint a short low-resolution clip starting at start seconds and return it as MP4 (no audio).
+
+    Frames are scaled down to CLIP_HEIGHT before inpainting, with the ROI scaled
+    to match, so the clip shows the method's look rather than exact output pixels.
+    video_info is (width, height, fps) when already known, e.g. from probe_media;
+    otherwise they are read from the capture.
+    """
+    cap = cv2.VideoCapture(input_video_path)
+    if not cap.isOpened():
+        raise RuntimeError('Failed to open input video')
+    try:
+        if video_info is not None:
+            width, height, fps = video_info
+        else:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        scale = min(1.0, CLIP_HEIGHT / height) if height else 1.0
+        # Even dimensions for yuv420p
+        out_w, out_h = max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+        x, y, w, h = clamp_roi(roi, width, height)
+        sx, sy = out_w / width, out_h / height
+        # Round outwards so the scaled ROI still covers the whole watermark
+        x0, y0 = int(x * sx), int(y * sy)
+        small_roi = (x0, y0, int(np.ceil((x + w) * sx)) - x0, int(np.ceil((y + h) * sy)) - y0)
+        inpainter = RoiInpainter((out_w, out_h), small_roi, inpaint_method)
+
+        cap.set(cv2.CAP_PROP_POS_MSEC, max(0.0, start) * 1000.0)
+        frames: List[bytes] = []
+        for _ in range(max(1, int(round(min(duration, CLIP_MAX_SECONDS) * fps)))):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            small = cv2.resize(frame, (out_w, out_h), interpolation=cv2.INTER_AREA)
+            frames.append(cv2.cvtColor(inpainter.apply(small), cv2.COLOR_BGR2RGB).tobytes())
+    finally:
+        cap.release()
+    if not frames:
+        raise RuntimeError(f'No frame at {start:.3f}s')
+
+    fd, clip_path = tempfile.mkstemp(suffix='.mp4', dir=temp_dir)
+    os.close(fd)
+    try:
+        cmd = build_encode_command(raw_video_input(out_w, out_h, fps), None, clip_path, 'fast', 'null')
+        proc = subprocess.run(cmd, input=b''.join(frames), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {proc.stderr.decode(errors='replace')[-800:]}")
+        with open(clip_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(clip_path)
+
+
+def data_url(data: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
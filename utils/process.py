@@ -0,0 +1,63 @@
+import os
+import shutil
+import time
+import uuid
+from typing import Optional, Sequence, Tuple
+
+from utils.ffmpeg import encode_frames_and_mux
+from utils.parallel import remove_watermark_roi_parallel
+from utils.pipeline import ProgressCallback, TimingCallback, remove_watermark_roi_streaming
+from utils.ranges import remove_watermark_roi_ranges
+from utils.video import remove_watermark_roi_to_frames
+
+PIPELINES = ('parallel', 'stream', 'frames')
+
+
+def process_video(input_path: str, output_path: str, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea',
+                  quality: str = 'ultra', scale_filter: Optional[str] = None, pipeline: str = 'parallel', decoder: str = 'opencv',
+                  workers: Optional[int] = None, temp_dir: Optional[str] = None,
+                  time_ranges: Optional[Sequence[Tuple[float, float]]] = None,
+                  progress: Optional[ProgressCallback] = None, timing: Optional[TimingCallback] = None, cancel_event=None,
+                  reuse_tolerance: Optional[int] = None, refresh_interval: int = 0, fragmented: bool = False,
+                  media: Optional[dict] = None) -> None:
+    """Remove a watermark with the chosen pipeline; what /process runs for each job.
+
+    'parallel' splits the video at keyframes across worker processes, 'stream'
+    pipes raw frames into one ffmpeg and 'frames' keeps the PNG intermediate.
+    time_ranges switches to ranged removal and ignores pipeline. Intermediate
+    files go to temp_dir (default: next to output_path). fragmented writes
+    fragmented MP4 instead of a faststart one; the stream pipeline then produces
+    a readable output_path from the first keyframe on, the others during their
+    final encode or concat pass. media is the input's probe_media record; when
+    given the pipelines read frame size, keyframes and codec details from it
+    instead of probing the file again.
+    """
+    temp_dir = temp_dir or os.path.dirname(os.path.abspath(output_path))
+    video_info = (media['width'], media['height'], media['fps']) if media else None
+    cache_options = {'reuse_tolerance': reuse_tolerance, 'refresh_interval': refresh_interval}
+
+    if time_ranges:
+        remove_watermark_roi_ranges(input_path, output_path, roi, time_ranges, inpaint_method, quality, scale_filter,
+                                    workers=workers, temp_dir=temp_dir, progress=progress, cancel_event=cancel_event,
+                                    timing=timing, fragmented=fragmented, media=media, **cache_options)
+    elif pipeline == 'frames':
+        frames_dir = os.path.join(temp_dir, f"frames_{uuid.uuid4().hex}")
+        try:
+            fps = remove_watermark_roi_to_frames(input_path, frames_dir, roi, inpaint_method, progress=progress,
+                                                 cancel_event=cancel_event, timing=timing, video_info=video_info, **cache_options)
+            started = time.perf_counter()
+            encode_frames_and_mux(frames_dir, fps, input_path, output_path, quality, scale_filter, cancel_event, fragmented)
+            if timing is not None:
+                timing('encode', time.perf_counter() - started)
+            if progress is not None:
+                progress('encode', len(os.listdir(frames_dir)))
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+    elif pipeline == 'stream':
+        remove_watermark_roi_streaming(input_path, output_path, roi, inpaint_method, quality, scale_filter, decoder,
+                                       progress=progress, cancel_event=cancel_event, timing=timing, fragmented=fragmented,
+                                       video_info=video_info, **cache_options)
+    else:
+        remove_watermark_roi_parallel(input_path, output_path, roi, inpaint_method, quality, scale_filter,
+                                      workers=workers, temp_dir=temp_dir, progress=progress, cancel_event=cancel_event,
+                                      timing=timing, fragmented=fragmented, media=media, **cache_options)
@@ -0,0 +1,170 @@
+import os
+import shutil
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Sequence, Tuple
+
+from utils.ffmpeg import color_args, mp4_movflags, probe_media, run_ffmpeg, split_gops
+from utils.parallel import SEGMENTS_PER_WORKER, plan_segments, run_segments, write_concat_list
+from utils.pipeline import STAGES, ProgressCallback, TimingCallback, remove_watermark_roi_streaming
+
+
+# Sources whose GOPs can be stream-copied next to freshly encoded x264 GOPs
+COPYABLE_CODECS = {('h264', 'yuv420p')}
+
+# swscale matrix names for ffprobe colour spaces. The ffmpeg decoder converts
+# to RGB with the source matrix, so the encoder must convert back with the same one.
+SWS_MATRICES = {
+    'bt709': 'bt709', 'smpte170m': 'smpte170m', 'bt470bg': 'bt470', 'fcc': 'fcc',
+    'smpte240m': 'smpte240m', 'bt2020nc': 'bt2020', 'bt2020c': 'bt2020'
+}
+
+
+def frame_ranges(frame_times: Sequence[float], time_ranges: Sequence[Tuple[float, float]]) -> List[Tuple[int, int]]:
+    """Map (start, end) seconds to half-open frame index ranges over sorted frame_times, ends inclusive."""
+    ranges = []
+    for start, end in time_ranges:
+        first, last = bisect_left(frame_times, start), bisect_right(frame_times, end)
+        if first < last:
+            ranges.append((first, last))
+    return ranges
+
+
+def plan_runs(gops: List[Tuple[float, int]], active: List[Tuple[int, int]]) -> List[Tuple[bool, List[Tuple[float, int]], int]]:
+    """Group consecutive GOPs into (dirty, gops, first_frame) runs.
+
+    A GOP is dirty when any of its frames falls in an active range and so has
+    to be decoded, inpainted and re-encoded; clean GOPs can be stream-copied.
+    """
+    runs = []
+    first_frame = 0
+    for gop in gops:
+        last_frame = first_frame + gop[1]
+        dirty = any(first < last_frame and last > first_frame for first, last in active)
+        if runs and runs[-1][0] == dirty:
+            runs[-1][1].append(gop)
+        else:
+            runs.append((dirty, [gop], first_frame))
+        first_frame = last_frame
+    return runs
+
+
+def _shift(active: List[Tuple[int, int]], offset: int, count: int) -> List[Tuple[int, int]]:
+    """Active ranges relative to a segment starting at frame offset with count frames."""
+    return [(max(0, first - offset), min(count, last - offset)) for first, last in active
+            if first < offset + count and last > offset]
+
+
+def _copy_command(input_path: str, output_path: str, seek: float, frames: int) -> List[str]:
+    # Same keyframe seek as build_decode_command, but without decoding
+    seek_args = ['-noaccurate_seek', '-ss', f'{seek + 0.001:.6f}'] if seek else []
+    return ['ffmpeg', '-y', '-v', 'error', *seek_args, '-i', input_path, '-map', '0:v:0', '-frames:v', str(frames),
+            '-c:v', 'copy', output_path]
+
+
+def remove_watermark_roi_ranges(input_video_path: str, output_path: str, roi: Tuple[int, int, int, int],
+                                time_ranges: Sequence[Tuple[float, float]], inpaint_method: str = 'telea', quality: str = 'ultra',
+                                scale_filter: Optional[str] = None, workers: Optional[int] = None, temp_dir: Optional[str] = None,
+                                progress: Optional[ProgressCallback] = None, cancel_event=None,
+                                reuse_tolerance: Optional[int] = None, refresh_interval: int = 0,
+                                timing: Optional[TimingCallback] = None, fragmented: bool = False,
+                                media: Optional[dict] = None) -> int:
+    """Remove a watermark only during time_ranges, re-encoding just the GOPs that overlap them.
+
+    Clean GOPs are stream-copied from the source and the audio track is copied as
+    is (re-encoded to AAC only if MP4 cannot hold it). The concat demuxer puts
+    each segment's SPS/PPS in-band (its auto_convert option), which lets copied
+    and re-encoded H.264 be joined without re-encoding. Segments are Matroska:
+    an MP4 cut that starts mid-stream gets an edit list that hides its first
+    frame. Dirty runs keep the source resolution, colour matrix and tags, so
+    scale_filter is not applied to them. Sources other than 8-bit 4:2:0 H.264, and
+    rotated ones (copied GOPs would keep the rotation that decoded frames already
+    have applied), are fully re-encoded instead, inpainting only the frames
+    inside time_ranges. So are files without packet timestamps, whose frame
+    times are then taken to be evenly spaced at the stream's fps.
+
+    Copied frames are reported to progress for every stage once copied, and
+    timing gets 'copy' and 'concat' times besides the workers' stage times.
+    fragmented makes the output fragmented MP4 (see StreamingPipeline). media
+    is the probe_media record of the input; it is probed when not given.
+
+    Returns:
+        frames (int): number of frames in the output.
+    """
+    workers = workers or os.cpu_count() or 1
+    media = media or probe_media(input_video_path)
+    start_time, packets, stream = media['start_time'], media['packets'], media['stream']
+    video_info, has_audio = (media['width'], media['height'], media['fps']), media['has_audio']
+    if packets is None:
+        frame_times = [i / media['fps'] for i in range(media['frame_count'])]
+    else:
+        frame_times = sorted(pts - start_time for pts, _ in packets)
+    active = frame_ranges(frame_times, time_ranges)
+    if not active:
+        raise RuntimeError('No frames fall inside the requested time ranges')
+
+    copyable = (stream.get('codec_name'), stream.get('pix_fmt')) in COPYABLE_CODECS and not stream.get('rotation')
+    if packets is None or not copyable:
+        return remove_watermark_roi_streaming(input_video_path, output_path, roi, inpaint_method, quality, scale_filter, decoder='ffmpeg',
+                                              progress=progress, cancel_event=cancel_event, reuse_tolerance=reuse_tolerance,
+                                              refresh_interval=refresh_interval, active_frames=active, timing=timing,
+                                              fragmented=fragmented, video_info=video_info)
+
+    matrix = SWS_MATRICES.get(stream.get('color_space'))
+    segment_filter = f'scale=out_color_matrix={matrix}' if matrix else 'null'
+
+    work_dir = os.path.join(temp_dir or os.path.dirname(os.path.abspath(output_path)), f"ranges_{uuid.uuid4().hex}")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        runs = plan_runs(split_gops(start_time, packets), active)
+        dirty_frames = sum(sum(count for _, count in gops) for dirty, gops, _ in runs if dirty)
+
+        segment_paths, copies, encodes = [], [], []
+        for dirty, gops, first_frame in runs:
+            if not dirty:
+                path = os.path.join(work_dir, f"segment_{len(segment_paths):05d}.mkv")
+                frames = sum(count for _, count in gops)
+                copies.append((_copy_command(input_video_path, path, gops[0][0], frames), frames))
+                segment_paths.append(path)
+                continue
+            # Spread the dirty runs over the workers in proportion to their length
+            run_frames = sum(count for _, count in gops)
+            target = max(1, round(workers * SEGMENTS_PER_WORKER * run_frames / max(1, dirty_frames)))
+            offset = first_frame
+            for seek, frame_count in plan_segments(gops, target):
+                path = os.path.join(work_dir, f"segment_{len(segment_paths):05d}.mkv")
+                encodes.append(dict(input_path=input_video_path, output_path=path, roi=roi, inpaint_method=inpaint_method,
+                                    quality=quality, scale_filter=segment_filter, seek=seek, frame_count=frame_count,
+                                    reuse_tolerance=reuse_tolerance, refresh_interval=refresh_interval,
+                                    active_frames=_shift(active, offset, frame_count), colors=color_args(stream),
+                                    video_info=video_info))
+                segment_paths.append(path)
+                offset += frame_count
+
+        started = time.perf_counter()
+        for cmd, frames in copies:
+            run_ffmpeg(cmd, cancel_event)
+            if progress is not None:
+                for stage in STAGES:
+                    progress(stage, frames)
+        if timing is not None and copies:
+            timing('copy', time.perf_counter() - started)
+        encoded = run_segments(encodes, workers, progress, cancel_event, timing) if encodes else 0
+
+        audio_input = ['-i', input_video_path, '-map', '0:v:0', '-map', '1:a:0?'] if has_audio else ['-map', '0:v:0']
+        concat = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', write_concat_list(segment_paths, os.path.join(work_dir, 'segments.txt')),
+                  *audio_input, '-c:v', 'copy', *mp4_movflags(fragmented)]
+        started = time.perf_counter()
+        try:
+            run_ffmpeg([*concat, *(['-c:a', 'copy'] if has_audio else []), output_path], cancel_event)
+        except RuntimeError:
+            if not has_audio or (cancel_event is not None and cancel_event.is_set()):
+                raise
+            # The source audio codec cannot go into MP4 as is
+            run_ffmpeg([*concat, '-c:a', 'aac', '-b:a', '192k', output_path], cancel_event)
+        if timing is not None:
+            timing('concat', time.perf_counter() - started)
+        return encoded + sum(frames for _, frames in copies)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+
+_HASH_NAME = re.compile(r'^[0-9a-f]{64}$')
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_STORED_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+
+def save_hashed(stream: BinaryIO, directory: str, ext: str) -> Tuple[str, bool]:
+    """Copy stream into directory as <sha256><ext>, hashing it while it is written.
+
+    When a file with the same content is already stored the new copy is dropped.
+
+    Returns:
+        (stored_name, existed)
+    """
+    digest = hashlib.sha256()
+    temp_path = os.path.join(directory, f".upload_{uuid.uuid4().hex}")
+    try:
+        with open(temp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        return _store(temp_path, digest.hexdigest(), directory, ext)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _store(temp_path: str, hex_digest: str, directory: str, ext: str) -> Tuple[str, bool]:
+    stored_name = f"{hex_digest}{ext}"
+    stored_path = os.path.join(directory, stored_name)
+    if os.path.exists(stored_path):
+        os.remove(temp_path)
+        return stored_name, True
+    os.replace(temp_path, stored_path)
+    return stored_name, False
+
+
+def _discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class UploadConflict(RuntimeError):
+    """A chunk did not start where the upload currently ends; offset is where it does."""
+
+    def __init__(self, offset: int):
+        super().__init__(f'Upload continues at byte {offset}')
+        self.offset = offset
+
+
+class ChunkedUpload:
+    """A resumable upload whose chunks are appended straight to a hidden file in directory.
+
+    Once size bytes have arrived finish() renames that file to <sha256><ext>,
+    like save_hashed. The bytes on disk are the offset, and size and ext are
+    kept next to the data in a small JSON file, so an upload can be resumed
+    after a dropped connection or a server restart. The hash is updated as
+    chunks arrive and only recomputed from disk when that was interrupted.
+    """
+
+    def __init__(self, directory: str, upload_id: str, size: int, ext: str):
+        self.directory = directory
+        self.upload_id = upload_id
+        self.size = size
+        self.ext = ext
+        self.path = os.path.join(directory, f".partial_{upload_id}")
+        self.lock = threading.Lock()
+        self._digest = hashlib.sha256()
+        self._hashed = 0
+
+    @classmethod
+    def create(cls, directory: str, size: int, ext: str) -> 'ChunkedUpload':
+        upload = cls(directory, uuid.uuid4().hex, size, ext)
+        open(upload.path, 'wb').close()
+        with open(upload.path + '.json', 'w') as f:
+            json.dump({'size': size, 'ext': ext}, f)
+        return upload
+
+    @classmethod
+    def open(cls, directory: str, upload_id: str) -> Optional['ChunkedUpload']:
+        """Reattach to an upload created earlier, e.g. before a restart; None when unknown."""
+        if not _UPLOAD_ID.match(upload_id):
+            return None
+        try:
+            with open(os.path.join(directory, f".partial_{upload_id}.json")) as f:
+                info = json.load(f)
+            upload = cls(directory, upload_id, int(info['size']), str(info['ext']))
+        except (OSError, ValueError, KeyError):
+            return None
+        return upload if os.path.exists(upload.path) else None
+
+    @property
+    def offset(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def write(self, stream: BinaryIO, offset: int) -> int:
+        """Append stream at offset, which must be the current end; returns the new offset.
+
+        Whatever arrived is kept when the stream breaks off, so the client can
+        resume from offset after a failure. Raises UploadConflict when offset is
+        not the current end and RuntimeError when the data runs past size.
+        """
+        with open(self.path, 'ab') as f:
+            current = f.tell()
+            if offset != current:
+                raise UploadConflict(current)
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if current + len(chunk) > self.size:
+                    raise RuntimeError('Upload is larger than its declared size')
+                # Hash on the fly unless an earlier write was cut short; finish() then rehashes
+                if self._hashed == current:
+                    self._digest.update(chunk)
+                    self._hashed += len(chunk)
+                f.write(chunk)
+                current += len(chunk)
+            return current
+
+    @property
+    def complete(self) -> bool:
+        return self.offset == self.size
+
+    def finish(self) -> Tuple[str, bool]:
+        """Move the completed upload into place as <sha256><ext>; returns (stored_name, existed)."""
+        if not self.complete:
+            raise RuntimeError(f'Upload has {self.offset} of {self.size} bytes')
+        if self._hashed != self.size:
+            self._digest = hashlib.sha256()
+            with open(self.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    self._digest.update(chunk)
+        result = _store(self.path, self._digest.hexdigest(), self.directory, self.ext)
+        _discard(self.path + '.json')
+        return result
+
+    def abort(self) -> None:
+        _discard(self.path)
+        _discard(self.path + '.json')
+
+
+def expire_uploads(directory: str, max_age: float) -> None:
+    """Delete chunked uploads that have not received data for max_age seconds."""
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        if not entry.name.startswith('.partial_') or entry.name.endswith('.json'):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                os.remove(entry.path + '.json')
+        except OSError:
+            pass
+
+
+def metadata_path(path: str) -> str:
+    """Where the probe_media record of a stored video lives: a hidden file next to it."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.json")
+
+
+def save_metadata(path: str, media: dict) -> None:
+    temp_path = f"{metadata_path(path)}.{uuid.uuid4().hex}"
+    with open(temp_path, 'w') as f:
+        json.dump(media, f, separators=(',', ':'))
+    os.replace(temp_path, metadata_path(path))
+
+
+def discard_metadata(path: str) -> None:
+    _discard(metadata_path(path))
+
+
+def load_metadata(path: str) -> Optional[dict]:
+    """The record saved by save_metadata, or None when there is none (or it is unreadable)."""
+    try:
+        with open(metadata_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_stored_name(name: str) -> bool:
+    """Whether name has the <sha256><ext> form uploads are stored under, so it cannot point outside the directory."""
+    return bool(_STORED_NAME.match(name or ''))
+
+
+def content_hash(path: str) -> str:
+    """sha256 of a stored file, taken from its name when it was stored by save_hashed."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if _HASH_NAME.match(stem):
+        return stem
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_key(source_hash: str, roi: Tuple[int, int, int, int], inpaint_method: str, quality: str, scale_filter: str, **options) -> str:
+    """Cache key for a processed output. roi should already be clamped to the frame.
+
+    options holds any other setting that changes the output pixels (time ranges,
+    reuse tolerance, ...); None values are left out so defaults share a key.
+    """
+    fields = {'source': source_hash, 'roi': list(roi), 'method': inpaint_method.lower(), 'quality': quality,
+              'scale': scale_filter}
+    fields.update({name: value for name, value in options.items() if value is not None})
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def follow_file(path: str, finished: Callable[[], bool], poll: float = 0.25) -> Iterator[bytes]:
+    """Yield the contents of a file that is still being written, like tail -f from the start.
+
+    Waits for the file to appear and ends once finished() is true and everything
+    written has been read. The open handle keeps working if the writer renames
+    or deletes the file when it is done; yields nothing if that happened before
+    the file could be opened.
+    """
+    while True:
+        try:
+            f = open(path, 'rb')
+            break
+        except FileNotFoundError:
+            if finished():
+                return
+            time.sleep(poll)
+    with f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            if finished():
+                # Drain whatever was written between the last read and the check
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    yield chunk
+                return
+            time.sleep(poll)
+
+
+def read_range(f: BinaryIO, start: int, stop: int) -> Iterator[bytes]:
+    """Yield bytes start to stop (exclusive) of an open file in CHUNK_SIZE pieces, then close it."""
+    with f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+class DiskLru:
+    """Size-bounded least-recently-used eviction over the files of some directories.
+
+    Recency is the file mtime, bumped by touch(), so it survives restarts.
+    Hidden files (in-progress uploads) are ignored.
+    """
+
+    def __init__(self, directories: Sequence[str], max_bytes: int):
+        self.directories = list(directories)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def touch(self, path: str) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def usage(self) -> int:
+        return sum(size for _, size, _ in self._files())
+
+    def evict(self, keep: Iterable[str] = ()) -> List[str]:
+        """Delete least recently used files until usage fits in max_bytes, never those in keep."""
+        keep = {os.path.abspath(path) for path in keep}
+        removed = []
+        with self._lock:
+            files = self._files()
+            total = sum(size for _, size, _ in files)
+            for path, size, _ in sorted(files, key=lambda entry: entry[2]):
+                if total <= self.max_bytes:
+                    break
+                if os.path.abspath(path) in keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed.append(path)
+        return removed
+
+    def _files(self) -> List[Tuple[str, int, float]]:
+        files = []
+        for directory in self.directories:
+            for entry in os.scandir(directory):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
@@ -1,7 +1,102 @@
 import cv2
 import numpy as np
-from typing import Tuple
+from typing import Optional, Tuple
 import os
+import time
+
+
+INPAINT_RADIUS = 3
+INPAINT_METHODS = ('telea', 'ns')
+
+
+def clamp_roi(roi: Tuple[int, int, int, int], width: int, height: int) -> Tuple[int, int, int, int]:
+    """Clamp an (x, y, w, h) rectangle so it lies inside a width x height frame."""
+    x, y, w, h = roi
+    x = max(0, min(x, width - 1))
+    y = max(0, min(y, height - 1))
+    w = max(1, min(w, width - x))
+    h = max(1, min(h, height - y))
+    return x, y, w, h
+
+
+def inpaint_flags(inpaint_method: str) -> int:
+    return cv2.INPAINT_TELEA if inpaint_method.lower() == 'telea' else cv2.INPAINT_NS
+
+
+class RoiInpainter:
+    """Inpaint a fixed rectangle by working on a padded crop around it.
+
+    cv2.inpaint only reads pixels within the inpaint radius of the mask (plus a
+    one pixel band for the distance gradients), so running it on a crop padded by
+    radius + 2 gives exactly the same pixels as inpainting the full frame. The
+    crop mask and the output buffer are allocated once and reused for every frame.
+
+    With reuse_tolerance set, the band of known pixels around the ROI is compared
+    with the frame the cached patch was computed from; when no pixel differs by
+    more than the tolerance the cached patch is pasted instead of re-inpainting.
+    A tolerance of 0 only reuses on exact matches and so never changes the output.
+    refresh_interval forces a recompute at least every N frames to bound drift.
+    hits and misses count reused and recomputed frames.
+    """
+
+    def __init__(self, frame_size: Tuple[int, int], roi: Tuple[int, int, int, int], inpaint_method: str = 'telea', radius: int = INPAINT_RADIUS,
+                 reuse_tolerance: Optional[int] = None, refresh_interval: int = 0):
+        width, height = frame_size
+        x, y, w, h = clamp_roi(roi, width, height)
+        pad = radius + 2
+
+        self.roi = (x, y, w, h)
+        self.radius = radius
+        self.flags = inpaint_flags(inpaint_method)
+        self.reuse_tolerance = reuse_tolerance
+        self.refresh_interval = max(0, refresh_interval)
+        self.hits = 0
+        self.misses = 0
+
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+        self.crop = (slice(y0, y1), slice(x0, x1))
+        self._roi_in_crop = (slice(y - y0, y - y0 + h), slice(x - x0, x - x0 + w))
+
+        self.mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        self.mask[self._roi_in_crop] = 255
+        self._patch = np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+
+        # Crop the cached patch was computed from, and scratch space for the comparison
+        self._anchor = np.empty_like(self._patch) if reuse_tolerance is not None else None
+        self._diff = np.empty_like(self._patch) if reuse_tolerance is not None else None
+        self._since_refresh = None
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """Inpaint the ROI of a BGR frame in place and return the same frame."""
+        crop = frame[self.crop]
+        if self._can_reuse(crop):
+            self.hits += 1
+            self._since_refresh += 1
+        else:
+            cv2.inpaint(crop, self.mask, self.radius, self.flags, dst=self._patch)
+            if self._anchor is not None:
+                np.copyto(self._anchor, crop)
+            self.misses += 1
+            self._since_refresh = 0
+        # Only the ROI: on a cache hit the band around it may have changed within the tolerance
+        frame[self.crop][self._roi_in_crop] = self._patch[self._roi_in_crop]
+        return frame
+
+    def _can_reuse(self, crop: np.ndarray) -> bool:
+        if self._anchor is None or self._since_refresh is None:
+            return False
+        if self.refresh_interval and self._since_refresh + 1 >= self.refresh_interval:
+            return False
+        cv2.absdiff(crop, self._anchor, dst=self._diff)
+        # Pixels under the mask are overwritten, so changes there do not matter
+        self._diff[self._roi_in_crop] = 0
+        return int(self._diff.max()) <= self.reuse_tolerance
 
 
 def remove_watermark_roi(input_video_path: str, output_video_path: str, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea') -> None:
@@ -23,31 +118,30 @@ def remove_watermark_roi(input_video_path: str, output_video_path: str, roi: Tup
         cap.release()
         raise RuntimeError('Failed to open output video for writing')
 
-    x, y, w, h = roi
-    x = max(0, min(x, width - 1))
-    y = max(0, min(y, height - 1))
-    w = max(1, min(w, width - x))
-    h = max(1, min(h, height - y))
-
-    flags = cv2.INPAINT_TELEA if inpaint_method.lower() == 'telea' else cv2.INPAINT_NS
+    inpainter = RoiInpainter((width, height), roi, inpaint_method)
 
     while True:
         ret, frame = cap.read()
         if not ret:
             break
-
-        mask = np.zeros((height, width), dtype=np.uint8)
-        mask[y:y+h, x:x+w] = 255
-        inpainted = cv2.inpaint(frame, mask, 3, flags)
-        out.write(inpainted)
+        out.write(inpainter.apply(frame))
 
     cap.release()
     out.release()
 
 
-def remove_watermark_roi_to_frames(input_video_path: str, output_frames_dir: str, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea') -> float:
+def remove_watermark_roi_to_frames(input_video_path: str, output_frames_dir: str, roi: Tuple[int, int, int, int], inpaint_method: str = 'telea',
+                                   progress=None, cancel_event=None, reuse_tolerance: Optional[int] = None, refresh_interval: int = 0,
+                                   timing=None, video_info: Optional[Tuple[int, int, float]] = None) -> float:
     """Remove watermark and write lossless PNG frames to a directory.
 
+    progress(stage, frames) is called per frame for the 'decode' and 'inpaint'
+    stages, and with 'reused' when a cached patch was reused (see RoiInpainter);
+    setting cancel_event stops the loop with a RuntimeError. timing(stage, seconds)
+    is called once per 'decode', 'inpaint' and 'write' (PNG compression) at the end.
+    video_info is (width, height, fps) when already known, e.g. from probe_media;
+    otherwise they are read from the capture.
+
     Returns:
         fps (float): frames per second of the source video for proper encoding later.
     """
@@ -57,33 +151,50 @@ def remove_watermark_roi_to_frames(input_video_path: str, output_frames_dir: str
     if not cap.isOpened():
         raise RuntimeError('Failed to open input video')
 
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
-
-    x, y, w, h = roi
-    x = max(0, min(x, width - 1))
-    y = max(0, min(y, height - 1))
-    w = max(1, min(w, width - x))
-    h = max(1, min(h, height - y))
+    if video_info is not None:
+        width, height, fps = video_info
+    else:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
 
-    flags = cv2.INPAINT_TELEA if inpaint_method.lower() == 'telea' else cv2.INPAINT_NS
+    inpainter = RoiInpainter((width, height), roi, inpaint_method, reuse_tolerance=reuse_tolerance, refresh_interval=refresh_interval)
 
+    seconds = {'decode': 0.0, 'inpaint': 0.0, 'write': 0.0}
     idx = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        mask = np.zeros((height, width), dtype=np.uint8)
-        mask[y:y+h, x:x+w] = 255
-        inpainted = cv2.inpaint(frame, mask, 3, flags)
-        # Write as PNG (lossless)
-        fname = os.path.join(output_frames_dir, f"frame_{idx:06d}.png")
-        ok = cv2.imwrite(fname, inpainted)
-        if not ok:
-            cap.release()
-            raise RuntimeError(f'Failed to write frame {fname}')
-        idx += 1
+    frame = None
+    try:
+        while True:
+            # Decode into the previous frame's buffer so no per-frame allocation happens
+            started = time.perf_counter()
+            ret, frame = cap.read(frame)
+            decoded = time.perf_counter()
+            seconds['decode'] += decoded - started
+            if not ret:
+                break
+            if cancel_event is not None and cancel_event.is_set():
+                raise RuntimeError('Processing cancelled')
+            if progress is not None:
+                progress('decode', 1)
+            hits = inpainter.hits
+            inpainter.apply(frame)
+            inpainted = time.perf_counter()
+            seconds['inpaint'] += inpainted - decoded
+            if progress is not None and inpainter.hits > hits:
+                progress('reused', 1)
+            # Write as PNG (lossless)
+            fname = os.path.join(output_frames_dir, f"frame_{idx:06d}.png")
+            ok = cv2.imwrite(fname, frame)
+            seconds['write'] += time.perf_counter() - inpainted
+            if not ok:
+                raise RuntimeError(f'Failed to write frame {fname}')
+            if progress is not None:
+                progress('inpaint', 1)
+            idx += 1
+    finally:
+        cap.release()
+        if timing is not None:
+            for stage, value in seconds.items():
+                timing(stage, value)
 
-    cap.release()
     return float(fps)